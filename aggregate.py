@@ -0,0 +1,56 @@
+import hashlib
+import json
+
+from preprocessing import cache_path, load_clean, read_cache, write_cache
+
+# finest design cell; every plotted table is a roll-up of this
+DESIGN = ['Subject', 'Region', 'Task', 'Attention', 'Awareness']
+
+
+# trial count, sum, mean and median of the measure in every Subject x design cell
+def build_cube(df, measure):
+    # measures are stored as float32/int8; sum in float64 so roll-ups stay exact
+    values = df[measure].astype('float64')
+    cube = values.groupby([df[key] for key in DESIGN], observed = True).agg(['count', 'sum', 'mean', 'median'])
+    cube['count'] = cube['count'].astype('int64')
+    return cube.reset_index()
+
+
+def subset_cube(cube, subset):
+    for column, level in subset.items():
+        if column not in DESIGN:
+            raise ValueError(f"Cannot subset the cube on '{column}'; it is not one of {DESIGN}")
+        cube = cube[cube[column] == level]
+    return cube
+
+
+# trial-weighted mean over coarser keys, identical to df.groupby(keys)[measure].mean();
+# medians do not roll up, so only the cube's own cells carry them
+def rollup(cube, keys, measure):
+    out = cube.groupby(keys, observed = True)[['count', 'sum']].sum().reset_index()
+    out[measure] = out['sum'] / out['count']
+    return out.drop(columns = 'sum')
+
+
+# the cube is persisted next to the cleaned-data cache, keyed by the source hash
+# (and the RT filter options, if any), so plots never reload trial-level data
+def cube_path(path, kind, measure, filter = None):
+    key = f'{kind}-cube-{measure}'
+    if filter:
+        key += '-' + hashlib.sha256(json.dumps(filter, sort_keys = True).encode()).hexdigest()[:8]
+    return cache_path(path, key)
+
+
+def load_cube(path, kind, measure, filter = None, cache = True):
+    cached = cube_path(path, kind, measure, filter)
+    cube = read_cache(cached) if cache else None
+    if cube is None:
+        df = load_clean(path, kind, cache = cache)
+        if filter:
+            from rt_filter import filter_rt
+
+            df, _ = filter_rt(df, **filter)
+        cube = build_cube(df, measure)
+        if cache:
+            write_cache(cube, cached)
+    return cube
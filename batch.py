@@ -0,0 +1,279 @@
+import argparse
+import contextlib
+import copy
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import pipeline
+
+# queue layout: a task file moves todo/ -> running/ -> done/ or failed/; a rename is
+# atomic on one filesystem, so only one worker (on any machine) can claim a task
+QUEUE_DIRS = ('todo', 'running', 'done', 'failed')
+# seconds between a worker's touches of its running/ task file; requeue() only takes
+# back tasks that have missed more than one of these
+HEARTBEAT = 30
+
+
+# manifest: {"spec": "analysis_spec.json", "output_dir": "results/cohorts",
+#            "cohorts": {"pilot": {"dir": "data/pilot"},
+#                        "site_b": {"rt": "b/rt.csv", "raw": "b/raw.csv"}}}
+# a cohort's 'dir' holds the usual file names; a data source name overrides its path
+def load_manifest(path):
+    with open(path) as f:
+        manifest = json.load(f)
+    manifest.setdefault('spec', pipeline.SPEC_PATH)
+    manifest.setdefault('output_dir', os.path.join('results', 'cohorts'))
+    return manifest
+
+
+def cohort_dir(manifest, name):
+    return os.path.join(manifest['output_dir'], name)
+
+
+# the base spec with this cohort's data paths and its own output directory
+def cohort_spec(spec, manifest, name):
+    cohort = manifest['cohorts'][name]
+    spec = copy.deepcopy(spec)
+    for source_name, source in spec['data'].items():
+        if source_name in cohort:
+            source['path'] = cohort[source_name]
+        elif 'dir' in cohort:
+            source['path'] = os.path.join(cohort['dir'], os.path.basename(source['path']))
+        else:
+            raise ValueError(f"Cohort '{name}' has no 'dir' and no path for data source '{source_name}'")
+    spec['output_dir'] = cohort_dir(manifest, name)
+    return spec
+
+
+# writes every cohort's spec next to its results; returns {name: task}
+# backend overrides every model's backend in the cohort specs
+def prepare(manifest, backend = None):
+    spec = pipeline.with_backend(pipeline.load_spec(manifest['spec']), backend)
+    tasks = {}
+    for name in manifest['cohorts']:
+        out_dir = cohort_dir(manifest, name)
+        os.makedirs(out_dir, exist_ok = True)
+        spec_path = os.path.join(out_dir, 'spec.json')
+        with open(spec_path, 'w') as f:
+            json.dump(cohort_spec(spec, manifest, name), f, indent = 2)
+        tasks[name] = {'name': name,
+                       'spec': spec_path,
+                       'state': os.path.join(out_dir, 'pipeline_state.json'),
+                       'log': os.path.join(out_dir, 'run.log')}
+    return tasks
+
+
+# one cohort's pipeline (data, models, post-hoc, figures); only changed stages rerun
+def run_cohort(task, force = False, n_workers = None):
+    started = time.perf_counter()
+    with open(task['log'], 'a') as log, contextlib.redirect_stdout(log):
+        stale = pipeline.run(task['spec'], force, n_workers, task['state'])
+    return {'name': task['name'], 'stages': stale, 'seconds': time.perf_counter() - started,
+            'host': socket.gethostname()}
+
+
+# cohorts run in parallel; each gets an equal share of the cores for its own model pool
+def run_local(manifest, n_workers = None, force = False, backend = None):
+    tasks = prepare(manifest, backend)
+    n_cpu = os.cpu_count() or 1
+    n_workers = max(1, min(n_workers or n_cpu, len(tasks)))
+    inner = max(1, n_cpu // n_workers)
+
+    status = {}
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers = n_workers, mp_context = context) as pool:
+        futures = {name: pool.submit(run_cohort, task, force, inner) for name, task in tasks.items()}
+        for name, future in futures.items():
+            try:
+                status[name] = future.result()
+                print(f"{name}: {len(status[name]['stages'])} stages in {status[name]['seconds']:.1f} s")
+            except Exception as e:
+                status[name] = {'name': name, 'error': repr(e)}
+                print(f"{name}: failed ({e!r}); see {tasks[name]['log']}")
+    return status
+
+
+def _write_json(obj, path):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(obj, f, indent = 1)
+    os.replace(tmp, path)
+
+
+def submit(manifest, queue_dir, backend = None):
+    for sub in QUEUE_DIRS:
+        os.makedirs(os.path.join(queue_dir, sub), exist_ok = True)
+    tasks = prepare(manifest, backend)
+    for name, task in tasks.items():
+        _write_json(task, os.path.join(queue_dir, 'todo', name + '.json'))
+    return list(tasks)
+
+
+# takes the next task off the queue, or None when todo/ is empty
+def claim(queue_dir):
+    todo = os.path.join(queue_dir, 'todo')
+    owner = f'{socket.gethostname()}-{os.getpid()}'
+    for filename in sorted(os.listdir(todo)):
+        if not filename.endswith('.json'):
+            continue
+        running = os.path.join(queue_dir, 'running', f'{filename[:-5]}@{owner}.json')
+        try:
+            os.rename(os.path.join(todo, filename), running)
+        except FileNotFoundError:
+            # another worker got it first
+            continue
+        # requeue() measures from the claim (then from the last heartbeat), not from the submit
+        os.utime(running)
+        return running
+    return None
+
+
+# touches the running task file every HEARTBEAT seconds until stop is set
+def heartbeat(path, stop):
+    while not stop.wait(HEARTBEAT):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return
+
+
+# runs queued cohorts until todo/ is empty; any number of these can share a queue
+def work(queue_dir, force = False, n_workers = None):
+    done = []
+    while True:
+        running = claim(queue_dir)
+        if running is None:
+            return done
+        with open(running) as f:
+            task = json.load(f)
+        stop = threading.Event()
+        beat = threading.Thread(target = heartbeat, args = (running, stop), daemon = True)
+        beat.start()
+        try:
+            task['result'] = run_cohort(task, force, n_workers)
+            target = 'done'
+            done.append(task['name'])
+        except Exception:
+            task['error'] = traceback.format_exc()
+            target = 'failed'
+        finally:
+            stop.set()
+            beat.join()
+        _write_json(task, running)
+        os.replace(running, os.path.join(queue_dir, target, task['name'] + '.json'))
+        print(f"{task['name']}: {target}")
+
+
+# `processes` local workers sharing the queue with workers on other machines
+def work_local(queue_dir, processes = 1, force = False):
+    n_cpu = os.cpu_count() or 1
+    if processes == 1:
+        return work(queue_dir, force, n_cpu)
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers = processes, mp_context = context) as pool:
+        futures = [pool.submit(work, queue_dir, force, max(1, n_cpu // processes)) for _ in range(processes)]
+        return [name for future in futures for name in future.result()]
+
+
+# puts tasks whose worker died back on the queue: live workers touch their task every
+# HEARTBEAT seconds, so a task untouched for max_age seconds has lost its worker
+def requeue(queue_dir, max_age = 5 * 60):
+    if max_age <= 2 * HEARTBEAT:
+        raise ValueError(f"max_age must be over {2 * HEARTBEAT} s (two heartbeats), or tasks of live workers are requeued")
+    moved = []
+    running = os.path.join(queue_dir, 'running')
+    for filename in os.listdir(running):
+        path = os.path.join(running, filename)
+        if filename.endswith('.json') and time.time() - os.path.getmtime(path) >= max_age:
+            name = filename[:-5].rsplit('@', 1)[0]
+            os.replace(path, os.path.join(queue_dir, 'todo', name + '.json'))
+            moved.append(name)
+    return moved
+
+
+# every cohort's exported tables (results_export: coefs, anova, estimates, contrasts)
+# in one, with a cohort column; cohorts without an export yet are left out
+def summarize(manifest):
+    from results_export import load_tables
+
+    tables = []
+    for name in manifest['cohorts']:
+        try:
+            table = load_tables(cohort_dir(manifest, name))
+        except FileNotFoundError:
+            continue
+        table.insert(0, 'cohort', name)
+        tables.append(table)
+    return pd.concat(tables, ignore_index = True) if tables else pd.DataFrame()
+
+
+def write_summary(manifest):
+    from results_export import write_tables
+
+    table = summarize(manifest)
+    if table.empty:
+        print("no cohort has exported tables yet")
+        return table
+    paths = write_tables(table, manifest['output_dir'])
+    print(f"{len(table)} rows from {table['cohort'].nunique()} cohorts -> {', '.join(paths)}")
+    return table
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Run the analysis pipeline over many cohorts.')
+    sub = parser.add_subparsers(dest = 'command', required = True)
+
+    p = sub.add_parser('run', help = 'run every cohort of the manifest on a local process pool')
+    p.add_argument('manifest')
+    p.add_argument('--workers', type = int, default = None, help = 'cohorts run at once')
+    p.add_argument('--force', action = 'store_true')
+    p.add_argument('--backend', choices = ['lme4', 'native'], default = None,
+                   help = 'override the model backend of every spec model')
+
+    p = sub.add_parser('submit', help = 'put every cohort of the manifest on a shared queue')
+    p.add_argument('manifest')
+    p.add_argument('--queue', required = True)
+    p.add_argument('--backend', choices = ['lme4', 'native'], default = None,
+                   help = 'override the model backend of every spec model')
+
+    p = sub.add_parser('work', help = 'run queued cohorts until the queue is empty')
+    p.add_argument('--queue', required = True)
+    p.add_argument('--processes', type = int, default = 1, help = 'local workers on this machine')
+    p.add_argument('--force', action = 'store_true')
+
+    p = sub.add_parser('requeue', help = 'return running tasks to the queue, e.g. after a crash')
+    p.add_argument('--queue', required = True)
+    p.add_argument('--older-than', type = float, default = 5,
+                   help = f'minutes without a heartbeat (workers send one every {HEARTBEAT} s)')
+
+    p = sub.add_parser('summary', help = 'merge the cohorts\' exported tables into one')
+    p.add_argument('manifest')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        manifest = load_manifest(args.manifest)
+        status = run_local(manifest, args.workers, args.force, args.backend)
+        write_summary(manifest)
+        return int(any('error' in s for s in status.values()))
+    if args.command == 'submit':
+        print(f"queued: {', '.join(submit(load_manifest(args.manifest), args.queue, args.backend))}")
+    elif args.command == 'work':
+        work_local(args.queue, args.processes, args.force)
+    elif args.command == 'requeue':
+        print(f"requeued: {', '.join(requeue(args.queue, args.older_than * 60))}")
+    elif args.command == 'summary':
+        write_summary(load_manifest(args.manifest))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
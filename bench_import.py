@@ -0,0 +1,55 @@
+import argparse
+import subprocess
+import sys
+
+# modules that must stay out of each entry point's import graph
+HEAVY = ['pymer4', 'rpy2', 'seaborn', 'matplotlib', 'statannotations', 'janitor', 'dataframe_image', 'scipy']
+
+# import-time budget (seconds) for the module behind each entry point
+BUDGETS = {'cli': 0.2,
+           'rt_plots': 1.5,
+           'acc_seen_plots': 1.5,
+           'pipeline': 1.5,
+           'lmms_rt': 1.5,
+           'lmms_seen_acc': 1.5}
+
+probe = """
+import sys, time
+t = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t
+print(elapsed)
+print(','.join(m for m in {heavy!r} if m in sys.modules))
+"""
+
+
+# best of `repeat` fresh interpreters, so every run pays the cold import cost
+def measure(module, repeat = 5):
+    times, loaded = [], ''
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', probe.format(module = module, heavy = HEAVY)],
+                             capture_output = True, text = True, check = True).stdout.split('\n')
+        times.append(float(out[0]))
+        loaded = out[1]
+    return min(times), [m for m in loaded.split(',') if m]
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Check that entry points import within budget.')
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--scale', type = float, default = 1.0, help = 'multiply every budget')
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':<16}{'import (s)':>12}{'budget (s)':>12}  heavy modules loaded")
+    for module, budget in BUDGETS.items():
+        elapsed, loaded = measure(module, args.repeat)
+        ok = elapsed <= budget * args.scale and not loaded
+        failed |= not ok
+        print(f"{module:<16}{elapsed:>12.3f}{budget * args.scale:>12.2f}  {', '.join(loaded) or '-'}"
+              f"{'' if ok else '  FAIL'}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import argparse
+import os
+import tempfile
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from preprocessing import clean_raw, clean_rt, read_export, stream_clean
+from synthetic import write_exports
+
+
+# the cleaned schema before compact(): object strings, int64 codes, float64 RTs
+def object_schema(df):
+    dtypes = {column: object for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)}
+    dtypes['Subject'] = 'int64'
+    dtypes.update({column: 'int64' for column in ('Seen', 'Target.ACC') if column in df})
+    if 'Target.RT' in df:
+        dtypes['Target.RT'] = 'float64'
+    return df.astype(dtypes)
+
+
+def frame_mb(df):
+    return df.memory_usage(deep = True).sum() / 1024 ** 2
+
+
+# peak traced memory (MB) while running fn, and its result
+def traced(fn, *args):
+    tracemalloc.start()
+    try:
+        result = fn(*args)
+        return tracemalloc.get_traced_memory()[1] / 1024 ** 2, result
+    finally:
+        tracemalloc.stop()
+
+
+# the export with n_columns unused columns added, as the experiment software writes
+# many more columns than the analysis reads: half numeric, half text
+def pad_export(path, n_columns, seed = 0):
+    df = pd.read_csv(path, sep = ';', dtype = str, keep_default_na = False)
+    rng = np.random.default_rng(seed)
+    extra = {f'Unused{i}': rng.integers(0, 1000, len(df)) if i % 2 else rng.choice(['Block', 'Practice', 'Session'], len(df))
+             for i in range(n_columns)}
+    pd.concat([df, pd.DataFrame(extra)], axis = 1).to_csv(path, sep = ';', index = False)
+
+
+def bench_size(n_subjects, n_trials, work_dir, extra_columns = 0):
+    write_exports(work_dir, n_subjects, n_trials)
+    rows = []
+    for name, kind, clean in (('rt_filtered.csv', 'rt', clean_rt), ('raw_data_all.csv', 'raw', clean_raw)):
+        path = os.path.join(work_dir, name)
+        if extra_columns:
+            pad_export(path, extra_columns)
+        # the export as it used to be parsed: every text column as per-row strings
+        object_peak, _ = traced(lambda: pd.read_csv(path, sep = ';', dtype = {'Seen': str, 'Awareness': str}).astype(
+            {column: object for column in ('Attention', 'Region', 'Task', 'TargetPresence')}))
+        # every column parsed, then cleaned, as load_clean() did before streaming
+        compact_peak, df = traced(lambda: clean(read_export(path)))
+        stream_peak, _ = traced(lambda: stream_clean(path, kind))
+        rows.append({'file': name, 'subjects': n_subjects, 'trials': n_trials, 'rows': len(df),
+                     'object_mb': frame_mb(object_schema(df)), 'compact_mb': frame_mb(df),
+                     'object_parse_peak_mb': object_peak, 'compact_load_peak_mb': compact_peak,
+                     'stream_load_peak_mb': stream_peak})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Memory of the cleaned trial data (object vs compact schema) and peak memory while loading it.')
+    parser.add_argument('--subjects', type = int, nargs = '+', default = [20, 80, 320])
+    parser.add_argument('--trials', type = int, default = 320, help = 'trials per subject')
+    parser.add_argument('--extra-columns', type = int, default = 0,
+                        help = 'unused columns added to the exports, as in wide experiment-software files')
+    args = parser.parse_args()
+
+    rows = []
+    for n_subjects in args.subjects:
+        with tempfile.TemporaryDirectory() as work_dir:
+            rows.extend(bench_size(n_subjects, args.trials, work_dir, args.extra_columns))
+
+    report = pd.DataFrame(rows)
+    report['reduction'] = report['object_mb'] / report['compact_mb']
+    report['stream_reduction'] = report['compact_load_peak_mb'] / report['stream_load_peak_mb']
+    print(report.round(2).to_string(index = False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from aggregate import build_cube
+from model_runner import run_jobs
+from pipeline import load_spec, model_jobs
+from preprocessing import clean_raw, clean_rt, read_export
+from render import render_figures
+from synthetic import write_exports
+
+# a stage only counts as a regression if it is this much slower than the baseline...
+TOLERANCE = 1.5
+# ...and by more than this many seconds, so sub-second noise is ignored
+MIN_SECONDS = 0.05
+
+
+# times every pipeline stage on one synthetic dataset; model fits report their
+# own fit/anova/post_hoc times from the worker
+def bench_size(spec, n_subjects, n_trials, work_dir, n_workers = None, backend = None,
+               models = True, seed = 0):
+    rows = []
+
+    def record(stage, seconds):
+        rows.append({'subjects': n_subjects, 'trials': n_trials, 'stage': stage, 'seconds': seconds})
+
+    n_raw, n_rt = write_exports(work_dir, n_subjects, n_trials, seed)
+
+    started = time.perf_counter()
+    raw_rt = read_export(os.path.join(work_dir, 'rt_filtered.csv'))
+    raw_all = read_export(os.path.join(work_dir, 'raw_data_all.csv'))
+    record('load', time.perf_counter() - started)
+
+    started = time.perf_counter()
+    frames = {'rt': clean_rt(raw_rt), 'raw': clean_raw(raw_all)}
+    record('preprocess', time.perf_counter() - started)
+
+    if models:
+        for source, df in frames.items():
+            started = time.perf_counter()
+            results = run_jobs(model_jobs(spec, source), df, n_workers, cache = False, backend = backend,
+                               server = None)
+            record(f'models:{source}', time.perf_counter() - started)
+            for result in results:
+                for step, seconds in result['timings'].items():
+                    record(f"{step}:{result['name']}", seconds)
+
+    started = time.perf_counter()
+    cubes = {}
+    for fig in spec['figures'].values():
+        key = (fig['data'], fig['measure'])
+        if key not in cubes:
+            cubes[key] = build_cube(frames[fig['data']], fig['measure'])
+    record('aggregate', time.perf_counter() - started)
+
+    started = time.perf_counter()
+    render_figures(spec['figures'], lambda fig: cubes[(fig['data'], fig['measure'])],
+                   os.path.join(work_dir, 'figures'), n_workers, force = True)
+    record('render', time.perf_counter() - started)
+
+    for row in rows:
+        row['rows'] = n_raw
+    return rows
+
+
+# stages at least TOLERANCE times (and MIN_SECONDS) slower than in the baseline report
+def regressions(report, baseline, tolerance = TOLERANCE):
+    key = ['subjects', 'trials', 'stage']
+    merged = pd.DataFrame(report).merge(pd.DataFrame(baseline), on = key, suffixes = ('', '_baseline'))
+    slower = (merged['seconds'] > tolerance * merged['seconds_baseline']) & \
+             (merged['seconds'] - merged['seconds_baseline'] > MIN_SECONDS)
+    return merged.loc[slower, key + ['seconds_baseline', 'seconds']]
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Time every pipeline stage on synthetic data of growing size.')
+    parser.add_argument('--spec', default = 'analysis_spec.json')
+    parser.add_argument('--subjects', type = int, nargs = '+', default = [20, 40, 80])
+    parser.add_argument('--trials', type = int, nargs = '+', default = [320], help = 'trials per subject')
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--backend', choices = ['lme4', 'native'], default = None)
+    parser.add_argument('--no-models', action = 'store_true', help = 'skip the model fits')
+    parser.add_argument('--output', help = 'write the timings to this JSON file')
+    parser.add_argument('--baseline', help = 'JSON report of an earlier run to check for regressions')
+    parser.add_argument('--tolerance', type = float, default = TOLERANCE)
+    args = parser.parse_args()
+
+    spec = load_spec(args.spec)
+    report = []
+    for n_subjects in args.subjects:
+        for n_trials in args.trials:
+            with tempfile.TemporaryDirectory() as work_dir:
+                report.extend(bench_size(spec, n_subjects, n_trials, work_dir, args.workers,
+                                         args.backend, not args.no_models))
+
+    table = pd.DataFrame(report).pivot_table(index = 'stage', columns = ['subjects', 'trials'],
+                                             values = 'seconds', sort = False)
+    print(table.round(3).to_string())
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent = 1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(report, json.load(f), args.tolerance)
+        if len(slower):
+            print(f"\nslower than {args.tolerance}x the baseline:")
+            print(slower.round(3).to_string(index = False))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from model_runner import run_jobs
+from model_server import find, request
+from pipeline import load_spec, model_jobs
+from preprocessing import clean_raw, clean_rt, read_export
+from synthetic import write_exports
+
+
+# starts a model server in its own process; returns it once it answers, with the
+# seconds its workers took to load R
+def start_server(address, n_workers):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_server.py')
+    process = subprocess.Popen([sys.executable, script, '--address', address, '--workers', str(n_workers)],
+                               stdout = subprocess.DEVNULL)
+    started = time.perf_counter()
+    while not find(address):
+        if process.poll() is not None:
+            raise RuntimeError(f"The model server exited with code {process.returncode}")
+        time.sleep(0.1)
+    return process, time.perf_counter() - started
+
+
+# the spec's models on synthetic data, `repeats` times on a fresh process pool each
+# (as every script run does today) and then `repeats` times on one model server
+def bench(spec, n_subjects, repeats, work_dir, n_workers = None, backend = None):
+    write_exports(work_dir, n_subjects)
+    frames = {'rt': clean_rt(read_export(os.path.join(work_dir, 'rt_filtered.csv'))),
+              'raw': clean_raw(read_export(os.path.join(work_dir, 'raw_data_all.csv')))}
+    # start-up and conversion costs are what differ, so resampling is left out
+    jobs = {source: [dict(job, conf_int = 'Wald') for job in model_jobs(spec, source)] for source in frames}
+    n_workers = n_workers or os.cpu_count() or 1
+
+    rows = []
+
+    def run_all(mode, server):
+        for run in range(repeats):
+            started = time.perf_counter()
+            for source, df in frames.items():
+                run_jobs(jobs[source], df, n_workers, cache = False, backend = backend, server = server)
+            rows.append({'mode': mode, 'run': run + 1, 'seconds': time.perf_counter() - started})
+
+    run_all('process pool', None)
+    address = os.path.join(work_dir, 'server.sock')
+    process, startup = start_server(address, n_workers)
+    try:
+        rows.append({'mode': 'server start', 'run': 0, 'seconds': startup})
+        run_all('model server', address)
+    finally:
+        request(address, 'shutdown')
+        process.wait()
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Time repeated model runs with and without the model server.')
+    parser.add_argument('--spec', default = 'analysis_spec.json')
+    parser.add_argument('--subjects', type = int, default = 20)
+    parser.add_argument('--repeats', type = int, default = 3)
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--backend', choices = ['lme4', 'native'], default = None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        table = bench(load_spec(args.spec), args.subjects, args.repeats, work_dir, args.workers, args.backend)
+    print(table.round(2).to_string(index = False))
+
+    pool = table.loc[table['mode'] == 'process pool', 'seconds'].mean()
+    server = table.loc[table['mode'] == 'model server', 'seconds'].mean()
+    print(f"\nper run: {pool:.2f} s on a fresh pool, {server:.2f} s on the server ({pool - server:.2f} s saved)")
+
+
+if __name__ == '__main__':
+    main()
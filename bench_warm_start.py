@@ -0,0 +1,62 @@
+import argparse
+import os
+import tempfile
+
+import pandas as pd
+
+from model_runner import run_jobs
+from pipeline import filter_options, load_spec, model_jobs
+from preprocessing import load_clean
+from synthetic import write_exports
+
+
+# fits the models of one data source twice, every model from its default start values
+# and then subset models from their parent's fit, and compares the optimizer work
+def compare(jobs, df, n_workers = None, backend = None):
+    # the start values only change the fit, so resampling is left out
+    jobs = [dict(job, conf_int = 'Wald') for job in jobs]
+    cold = run_jobs(jobs, df, n_workers, cache = False, backend = backend, warm = False)
+    warm = run_jobs(jobs, df, n_workers, cache = False, backend = backend)
+    rows = []
+    for default, started in zip(cold, warm):
+        row = {'model': default['name'], 'start': started['optimizer']['start']}
+        for key in ('iterations', 'evaluations', 'seconds'):
+            row[f'{key}_default'] = default['optimizer'][key]
+            row[f'{key}_warm'] = started['optimizer'][key]
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Optimizer work of the spec models with and without warm starts.')
+    parser.add_argument('--spec', default = 'analysis_spec.json')
+    parser.add_argument('--synthetic', type = int, metavar = 'SUBJECTS',
+                        help = 'use synthetic data with this many subjects instead')
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--backend', choices = ['lme4', 'native'], default = None)
+    args = parser.parse_args()
+
+    spec = load_spec(args.spec)
+    with tempfile.TemporaryDirectory() as work_dir:
+        if args.synthetic:
+            write_exports(work_dir, args.synthetic)
+        tables = []
+        for name, source in spec['data'].items():
+            path = os.path.join(work_dir, os.path.basename(source['path'])) if args.synthetic else source['path']
+            df = load_clean(path, source['kind'], cache = False)
+            if filter_options(source):
+                from rt_filter import filter_rt
+
+                df, _ = filter_rt(df, **filter_options(source))
+            tables.append(compare(model_jobs(spec, name), df, args.workers, args.backend))
+
+    table = pd.concat(tables, ignore_index = True)
+    print(table.round(3).to_string(index = False))
+    warm = table['start'] != 'default'
+    if warm.any():
+        saved = 1 - table.loc[warm, 'evaluations_warm'].sum() / table.loc[warm, 'evaluations_default'].sum()
+        print(f"\nwarm-started models: {saved:.0%} fewer objective evaluations")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+import collections
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from design import set_levels
+from result_cache import data_fingerprint
+
+# resamples are split into chunks of this size; each chunk is one task
+CHUNK_SIZE = 50
+PROGRESS_DIR = os.path.join('.cache', 'boot')
+
+# fitted models kept per worker process so a worker fits each model once; a model
+# server's workers live on, so only the most recently used MAX_MODELS are kept
+MAX_MODELS = 4
+
+_models = collections.OrderedDict()
+
+
+def data_key(job, data):
+    h = hashlib.sha256()
+    spec = {k: job[k] for k in ('formula', 'family', 'factors', 'ordered')}
+    h.update(json.dumps(spec, sort_keys = True).encode())
+    h.update(data_fingerprint(data).encode())
+    return h.hexdigest()[:16]
+
+
+# every chunk has a fixed seed derived from (seed, chunk index), so a run can be
+# resumed or extended with more resamples and still reproduce the same draws
+def chunk_seed(seed, index):
+    state = np.random.SeedSequence([seed, index]).generate_state(1)[0]
+    return int(state % (2 ** 31 - 1))
+
+
+def chunk_plan(n_boot, chunk_size = CHUNK_SIZE):
+    return [(i, min(chunk_size, n_boot - start))
+            for i, start in enumerate(range(0, n_boot, chunk_size))]
+
+
+def run_dir(job, data, seed, progress_dir = PROGRESS_DIR):
+    return os.path.join(progress_dir, f"{job['name']}-{data_key(job, data)}-s{seed}")
+
+
+def chunk_path(directory, index, nsim):
+    return os.path.join(directory, f'chunk-{index:04d}-{nsim}.npz')
+
+
+def _fitted_model(job, data, directory):
+    if directory in _models:
+        _models.move_to_end(directory)
+    else:
+        from pymer4.models import Lmer
+
+        model = Lmer(job['formula'], data = set_levels(data, job['factors']), family = job['family'])
+        model.fit(factors = job['factors'], ordered = job['ordered'], summarize = False)
+        _models[directory] = model
+        if len(_models) > MAX_MODELS:
+            _models.popitem(last = False)
+    return _models[directory]
+
+
+# runs in a worker: parametric bootstrap of the fixed effects for one chunk
+def boot_chunk(job, data, index, nsim, seed, directory):
+    from rpy2.robjects.packages import importr
+
+    lme4 = importr('lme4')
+    model = _fitted_model(job, data, directory)
+    boot = lme4.bootMer(model.model_obj, FUN = lme4.fixef, nsim = nsim,
+                        seed = chunk_seed(seed, index))
+    # R matrices iterate column-major
+    replicates = np.array(list(boot.rx2('t')), dtype = float).reshape(nsim, -1, order = 'F')
+
+    path = chunk_path(directory, index, nsim)
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, t = replicates, names = np.asarray(model.coefs.index, dtype = str))
+    os.replace(tmp, path)
+    return path
+
+
+# submit the chunks that are not on disk yet; finished chunks are reused
+def submit_bootstrap(pool, job, data, n_boot, seed = 0, chunk_size = CHUNK_SIZE,
+                     progress_dir = PROGRESS_DIR):
+    directory = run_dir(job, data, seed, progress_dir)
+    os.makedirs(directory, exist_ok = True)
+
+    futures = []
+    for index, nsim in chunk_plan(n_boot, chunk_size):
+        if not os.path.exists(chunk_path(directory, index, nsim)):
+            futures.append(pool.submit(boot_chunk, job, data, index, nsim, seed, directory))
+    return directory, futures
+
+
+# merge all chunks and take percentile intervals; failed resamples are NaN
+def percentile_ci(directory, n_boot, chunk_size = CHUNK_SIZE, alpha = 0.05):
+    replicates, names = [], None
+    for index, nsim in chunk_plan(n_boot, chunk_size):
+        with np.load(chunk_path(directory, index, nsim)) as chunk:
+            replicates.append(chunk['t'])
+            names = list(chunk['names'])
+    replicates = np.vstack(replicates)
+
+    lower, upper = np.nanpercentile(replicates, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis = 0)
+    return pd.DataFrame({'2.5_ci': lower, '97.5_ci': upper,
+                         'N_boot': np.sum(~np.isnan(replicates), axis = 0)}, index = names)
+
+
+# replace the Wald intervals with bootstrap intervals, as pymer4 does for conf_int='boot'
+def apply_boot_ci(coefs, ci):
+    coefs = coefs.copy()
+    coefs[['2.5_ci', '97.5_ci']] = ci.loc[coefs.index, ['2.5_ci', '97.5_ci']].values
+    coefs = coefs.drop(columns = [c for c in ('P-val', 'Sig') if c in coefs.columns])
+    coefs['Sig'] = np.where(coefs['2.5_ci'] * coefs['97.5_ci'] > 0, '*', '')
+    return coefs
+
+
+def run_bootstrap(job, data, n_boot = 500, seed = 0, chunk_size = CHUNK_SIZE,
+                  n_workers = None, progress_dir = PROGRESS_DIR):
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers = n_workers, mp_context = context) as pool:
+        directory, futures = submit_bootstrap(pool, job, data, n_boot, seed,
+                                              chunk_size, progress_dir)
+        for future in futures:
+            future.result()
+    return percentile_ci(directory, n_boot, chunk_size)
+
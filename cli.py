@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+import argparse
+import sys
+
+# only argparse is imported up front; each subcommand imports what it needs, so a
+# plot-only run never starts R
+
+
+def rt_models(args):
+    import lmms_rt
+    lmms_rt.main(args.spec, args.workers, args.backend)
+
+
+def seen_acc(args):
+    import lmms_seen_acc
+    lmms_seen_acc.main(args.spec, args.workers, args.backend)
+
+
+def plots(args):
+    from pipeline import cube_loader, load_spec
+    from render import render_figures
+
+    spec = load_spec(args.spec)
+    render_figures(spec['figures'], cube_loader(spec), args.out_dir, args.workers, args.force)
+
+
+def run_pipeline(args):
+    import pipeline
+    for stage in pipeline.run(args.spec, args.force, args.workers, backend = args.backend):
+        print(stage)
+
+
+def export_tables(args):
+    from pipeline import load_spec
+    from results_export import export
+    export(load_spec(args.spec), args.out_dir, not args.no_images, args.force)
+
+
+# fits the spec's models with both backends and reports how far the native
+# estimates are from lme4's, in lme4 standard errors
+def validate(args):
+    from model_runner import validate_backend
+    from pipeline import filter_options, load_spec, model_jobs
+    from preprocessing import load_clean
+
+    spec = load_spec(args.spec)
+    failed = []
+    for name, source in spec['data'].items():
+        df = load_clean(source['path'], source['kind'])
+        if filter_options(source):
+            from rt_filter import filter_rt
+
+            df, _ = filter_rt(df, **filter_options(source))
+        tables = validate_backend(model_jobs(spec, name), df, args.workers, args.tolerance)
+        for model, table in tables.items():
+            print(f"## model: {model}")
+            print(table)
+            if not table['ok'].all():
+                failed.append(model)
+    if failed:
+        print(f"native estimates outside {args.tolerance} SE: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+def search_ranef(args):
+    import ranef_search
+    ranef_search.run(args.spec, args.models, args.structures, args.workers, args.backend,
+                     args.budget, args.output)
+
+
+def power_analysis(args):
+    import power
+    power.run(args.spec, args.models, args.subjects, args.trials, args.workers, args.backend,
+              args.alpha, args.precision, args.max_sims, args.seed, args.output)
+
+
+def run_batch(args):
+    import batch
+    argv = list(args.args)
+    if args.backend:
+        # the backend is written into the cohort specs, so only run and submit take it
+        if not argv or argv[0] not in ('run', 'submit'):
+            print("--backend applies to 'batch run' and 'batch submit' only", file = sys.stderr)
+            return 2
+        argv += ['--backend', args.backend]
+    return batch.main(argv)
+
+
+def run_server(args):
+    import model_server
+    argv = ['--workers', str(args.workers)] if args.workers else []
+    argv += ['--status'] if args.status else ['--stop'] if args.stop else []
+    return model_server.main(argv)
+
+
+def ingest_subjects(args):
+    import ingest
+    for stage in ingest.ingest(args.spec, args.exports, args.workers, args.backend):
+        print(stage)
+
+
+def filter_rt(args):
+    from rt_filter import load_filtered_rt, print_report
+
+    df, report = load_filtered_rt(args.input, args.min_rt, args.sd, args.by)
+    print_report(report, args.min_rt, args.sd, args.by)
+    df.to_csv(args.output, sep = ';', index = False)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog = 'tms-behav', description = 'TMS behavioral analyses.')
+    parser.add_argument('--spec', default = 'analysis_spec.json')
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--backend', choices = ['lme4', 'native'], default = None,
+                        help = 'override the model backend of every spec model')
+    parser.add_argument('--report', nargs = '?', const = 'auto', default = None,
+                        help = 'write a JSON timing/memory report (default results/reports/<command>-<time>.json)')
+    parser.add_argument('--profile', help = 'write a cProfile dump of the run to this path')
+    parser.add_argument('--trace-memory', action = 'store_true',
+                        help = 'add tracemalloc peaks to the report (slower)')
+    sub = parser.add_subparsers(dest = 'command', required = True)
+
+    sub.add_parser('rt-models', help = 'RT GLMMs (lmms_rt.py)').set_defaults(func = rt_models)
+    sub.add_parser('seen-acc', help = 'ACC and Seen GLMMs (lmms_seen_acc.py)').set_defaults(func = seen_acc)
+
+    p = sub.add_parser('plots', help = 'render every figure in the spec')
+    p.add_argument('--out-dir', default = '.')
+    p.add_argument('--force', action = 'store_true')
+    p.set_defaults(func = plots)
+
+    p = sub.add_parser('pipeline', help = 'rerun the spec stages that changed')
+    p.add_argument('--force', action = 'store_true')
+    p.set_defaults(func = run_pipeline)
+
+    p = sub.add_parser('export', help = 'write the fitted models\' anova and post-hoc tables (results_export.py)')
+    p.add_argument('--out-dir', default = None, help = "default: the spec's output_dir")
+    p.add_argument('--no-images', action = 'store_true', help = 'only write the Parquet/CSV tables')
+    p.add_argument('--force', action = 'store_true', help = 'redraw every table image')
+    p.set_defaults(func = export_tables)
+
+    p = sub.add_parser('validate', help = 'compare native GLMM estimates with lme4')
+    p.add_argument('--tolerance', type = float, default = 0.1, help = 'in lme4 standard errors')
+    p.set_defaults(func = validate)
+
+    p = sub.add_parser('ranef-search', help = 'compare random-effects structures of the spec models')
+    p.add_argument('--models', nargs = '+', help = 'spec models to search (default: all)')
+    p.add_argument('--structures', nargs = '+', help = "e.g. '(1|Subject)' '(1+Attention|Subject)'")
+    p.add_argument('--budget', type = float, default = 600, help = 'seconds per candidate')
+    p.add_argument('--output', default = 'results/ranef_search.csv')
+    p.set_defaults(func = search_ranef)
+
+    p = sub.add_parser('power', help = 'simulation-based power of the spec models (power.py)')
+    p.add_argument('--models', nargs = '+', help = 'spec models (default: all)')
+    p.add_argument('--subjects', type = int, nargs = '+', default = [20])
+    p.add_argument('--trials', type = int, nargs = '+', default = [320], help = 'trials per subject')
+    p.add_argument('--alpha', type = float, default = 0.05)
+    p.add_argument('--precision', type = float, default = 0.05,
+                   help = 'stop once every 95%% interval on power is within +/- this')
+    p.add_argument('--max-sims', type = int, default = 1000)
+    p.add_argument('--seed', type = int, default = 0)
+    p.add_argument('--output', default = 'results/power.csv')
+    p.set_defaults(func = power_analysis)
+
+    p = sub.add_parser('batch', help = 'run the pipeline over the cohorts of a manifest (batch.py)',
+                       add_help = False)
+    p.add_argument('args', nargs = argparse.REMAINDER)
+    p.set_defaults(func = run_batch)
+
+    p = sub.add_parser('server', help = 'keep R and lme4 loaded for later runs (model_server.py)')
+    group = p.add_mutually_exclusive_group()
+    group.add_argument('--status', action = 'store_true', help = 'report on the running server')
+    group.add_argument('--stop', action = 'store_true', help = 'shut the running server down')
+    p.set_defaults(func = run_server)
+
+    p = sub.add_parser('ingest', help = 'add new subjects\' sessions and rerun the changed stages')
+    p.add_argument('exports', nargs = '+', help = 'session exports in the raw_data_all.csv format')
+    p.set_defaults(func = ingest_subjects)
+
+    p = sub.add_parser('filter-rt', help = 'write rt_filtered.csv from raw_data_all.csv')
+    p.add_argument('--input', default = 'raw_data_all.csv')
+    p.add_argument('--output', default = 'rt_filtered.csv')
+    p.add_argument('--min-rt', type = float, default = 150)
+    p.add_argument('--sd', type = float, default = 2.5)
+    p.add_argument('--by', choices = ['subject', 'condition'], default = 'subject')
+    p.set_defaults(func = filter_rt)
+    return parser
+
+
+def main(argv = None):
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    # argparse leaves options such as 'batch --help' out of REMAINDER
+    if args.command == 'batch':
+        args.args = extra + args.args
+    elif extra:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    if not (args.report or args.profile):
+        return args.func(args)
+
+    import instrument
+
+    instrument.start(args.command, args.trace_memory, args.profile)
+    try:
+        return args.func(args)
+    finally:
+        path = instrument.default_path(args.command) if args.report == 'auto' else args.report
+        instrument.finish(path)
+        if path:
+            print(f"run report: {path}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
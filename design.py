@@ -0,0 +1,115 @@
+import itertools
+import re
+
+import numpy as np
+import pandas as pd
+
+
+# 'Target.RT ~ Awareness*Attention*Region + (1|Subject)' -> ('Target.RT', [terms], 'Subject')
+# terms are tuples of factor names in R's order: main effects, then 2-way, ...
+def parse_formula(formula):
+    response, rhs = [part.strip() for part in formula.split('~', 1)]
+    group = None
+    fixed = []
+    for part in re.split(r'\+(?![^(]*\))', rhs):
+        part = part.strip()
+        random = re.fullmatch(r'\(\s*1\s*\|\s*([\w.]+)\s*\)', part)
+        if random:
+            group = random.group(1)
+        elif part not in ('', '1'):
+            fixed.append(part)
+
+    terms = []
+    for part in fixed:
+        # a*b expands to a + b + a:b, in the order R builds it before sorting by degree
+        expanded = [()]
+        for factor in part.split('*'):
+            factors = tuple(f.strip() for f in factor.split(':'))
+            expanded = expanded + [t + factors for t in expanded]
+        for term in expanded[1:]:
+            if term not in terms:
+                terms.append(term)
+    terms.sort(key = len)
+    return response, terms, group
+
+
+# contrast codes as pymer4 passes them to R: contr.poly when ordered, else contr.treatment
+def contrast_matrix(k, ordered):
+    if not ordered:
+        return np.eye(k)[:, 1:]
+    x = np.arange(1, k + 1, dtype = float)
+    x = x - x.mean()
+    # orthonormal polynomials, as in R's contr.poly
+    q, _ = np.linalg.qr(np.vander(x, k, increasing = True))
+    codes = q[:, 1:]
+    # fix the sign so each column increases with its highest power, like R
+    return codes * np.sign(codes[-1])
+
+
+# pymer4 passes unnamed contrast matrices, so R names columns Factor1, Factor2, ...
+def term_names(term, factors):
+    parts = [[f'{factor}{j + 1}' for j in range(len(factors[factor]) - 1)] for factor in term]
+    # the first factor varies fastest, as in R's model.matrix
+    return [':'.join(reversed(combo)) for combo in itertools.product(*reversed(parts))]
+
+
+def coef_names(terms, factors):
+    names = ['(Intercept)']
+    for term in terms:
+        names.extend(term_names(term, factors))
+    return names
+
+
+# makes every factor column a categorical with exactly these levels, in this order;
+# astype(CategoricalDtype(levels)) is not enough, since unordered categoricals with
+# the same levels in another order compare equal and pandas may keep the old order
+def set_levels(data, factors):
+    columns = {factor: pd.Categorical(data[factor], categories = levels)
+               for factor, levels in factors.items()
+               if factor in data and list(getattr(data[factor].dtype, 'categories', [])) != list(levels)}
+    return data.assign(**columns) if columns else data
+
+
+# per-factor contrast codes for every row of data (n x k-1)
+def factor_codes(data, factors, ordered):
+    codes = {}
+    for factor, levels in factors.items():
+        if factor not in data:
+            continue
+        index = pd.Categorical(data[factor], categories = levels).codes
+        if (index < 0).any():
+            raise ValueError(f"Not all levels of '{factor}' are in {levels}")
+        codes[factor] = contrast_matrix(len(levels), ordered)[index]
+    return codes
+
+
+# splits an R coefficient name such as 'Attention1:Region1' into [(factor, column), ...]
+def parse_coef(name, factors):
+    parsed = []
+    for part in name.split(':'):
+        for factor in sorted(factors, key = len, reverse = True):
+            suffix = part[len(factor):]
+            if part.startswith(factor) and suffix.isdigit():
+                parsed.append((factor, int(suffix) - 1))
+                break
+        else:
+            raise ValueError(f"Cannot match coefficient '{name}' to the factors {list(factors)}")
+    return parsed
+
+
+# model-matrix rows for the given coefficient names (one column per name)
+def coef_matrix(data, names, factors, ordered):
+    codes = factor_codes(data, factors, ordered)
+    X = np.ones((len(data), len(names)))
+    for j, name in enumerate(names):
+        if name == '(Intercept)':
+            continue
+        for factor, column in parse_coef(name, factors):
+            X[:, j] *= codes[factor][:, column]
+    return X
+
+
+def design_matrix(data, formula, factors, ordered):
+    response, terms, group = parse_formula(formula)
+    names = coef_names(terms, factors)
+    return names, coef_matrix(data, names, factors, ordered)
@@ -0,0 +1,62 @@
+import matplotlib.pyplot as plt
+import numpy as np
+import seaborn as sns
+from statannotations.Annotator import Annotator
+
+from model_runner import FACTORS
+
+estimators = {'mean': np.mean, 'median': np.median}
+
+
+# the boxplot + stripplot + median/mean pointplot + Annotator pattern used by every figure
+def draw_panel(ax, data, x, y, pairs, annotations, estimator = 'median', palette = None):
+    order = FACTORS.get(x)
+    sns.boxplot(data = data, x = x, y = y, order = order, dodge = .8 - .8 / 3, ax = ax,
+                whis = 0, showfliers = False, palette = palette)
+    sns.stripplot(data = data, x = x, y = y, order = order, ax = ax,
+                  edgecolor = 'black', linewidth = 1, alpha = 0.4, palette = palette)
+    sns.pointplot(data = data, x = x, y = y, order = order, estimator = estimators[estimator],
+                  color = 'black', linestyles = '--', ax = ax)
+    sns.despine(ax = ax, trim = True)
+
+    if pairs:
+        annotator = Annotator(ax, pairs = [tuple(pair) for pair in pairs], data = data,
+                              x = x, y = y, order = order)
+        annotator.set_custom_annotations(annotations)
+        annotator.configure(text_format = 'star', loc = 'outside')
+        annotator.annotate()
+
+
+# draws one figure spec from its figure_data() table; 'panels' splits the figure
+# into side-by-side axes, one per level; 'annotations' is one label per pair, or a
+# {panel level: labels} dict (see stats_tests.annotations)
+def draw_figure(fig, data, path):
+    x, y = fig['x'], fig['measure']
+    panels = fig.get('panels')
+    pairs = fig.get('pairs', [])
+    annotations = fig.get('annotations', ['*'] * len(pairs))
+
+    sns.set(style = 'ticks', font_scale = fig.get('font_scale', 2), rc = {"lines.linewidth": 0.7})
+
+    if panels is None:
+        figure, ax = plt.subplots()
+        draw_panel(ax, data, x, y, pairs, annotations, fig.get('estimator', 'median'), fig.get('palette'))
+        ax.set_ylabel(fig['ylabel'])
+    else:
+        levels = FACTORS.get(panels) or sorted(data[panels].unique())
+        figure, axes = plt.subplots(1, len(levels), figsize = (12, 6), sharey = True)
+        for i, (ax, level) in enumerate(zip(axes, levels)):
+            labels = annotations[str(level)] if isinstance(annotations, dict) else annotations
+            draw_panel(ax, data[data[panels] == level], x, y, pairs, labels,
+                       fig.get('estimator', 'median'), fig.get('palette'))
+            ax.set_xlabel(level)
+            if i == 0:
+                ax.set_ylabel(fig['ylabel'])
+            else:
+                ax.set_ylabel(' ')
+                ax.axes.get_yaxis().set_visible(False)
+                ax.spines['left'].set_visible(False)
+
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close(figure)
@@ -0,0 +1,237 @@
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import optimize, special, stats
+
+from design import design_matrix, parse_formula
+from posthoc import batch_post_hoc, sig_stars, wald_anova
+
+# families that estimate a dispersion parameter
+dispersion_families = ('gaussian', 'inverse_gaussian')
+
+
+# lme4's default links: logit, 1/mu^2 and identity
+def link(family, mu):
+    if family == 'binomial':
+        return special.logit(mu)
+    if family == 'inverse_gaussian':
+        return 1 / mu ** 2
+    if family == 'gaussian':
+        return mu
+    raise ValueError(f"Family '{family}' is not available in the native backend")
+
+
+def valid_eta(family, eta):
+    if family == 'inverse_gaussian':
+        return eta > 0
+    return np.isfinite(eta)
+
+
+# per-observation log-likelihood and its first and second derivatives in eta
+def family_terms(family, y, eta, phi):
+    if family == 'binomial':
+        mu = special.expit(eta)
+        return y * eta - np.logaddexp(0, eta), y - mu, -mu * (1 - mu)
+    if family == 'inverse_gaussian':
+        root = np.sqrt(eta)
+        ll = -0.5 * np.log(2 * np.pi * phi * y ** 3) - (y * eta - 2 * root + 1 / y) / (2 * phi)
+        return ll, (1 / root - y) / (2 * phi), -1 / (4 * phi * eta * root)
+    if family == 'gaussian':
+        ll = -0.5 * np.log(2 * np.pi * phi) - (y - eta) ** 2 / (2 * phi)
+        return ll, (y - eta) / phi, np.full_like(eta, -1 / phi)
+    raise ValueError(f"Family '{family}' is not available in the native backend")
+
+
+# random-intercept GLMM, y ~ fixed + (1|group), fitted by maximizing the Laplace
+# approximation to the marginal likelihood; same fit/anova/post_hoc interface as
+# pymer4's Lmer for the designs used here, without starting R
+class GLMM:
+
+    def __init__(self, formula, data, family = 'gaussian'):
+        self.formula = formula
+        self.data = data
+        self.family = family
+        self.fitted = False
+        self.warnings = []
+
+    # conditional modes of the random intercepts for fixed beta/tau/phi, by Newton
+    # steps on every group at once; returns the Laplace log-likelihood and the modes
+    def _laplace(self, beta, tau, phi, b):
+        family, y, g, G = self.family, self._y, self._groups, self._n_groups
+        offset = self._X @ beta
+        if not valid_eta(family, offset + b[g]).all():
+            b = np.zeros(G)
+            if not valid_eta(family, offset).all():
+                return -np.inf, b, None
+
+        for _ in range(50):
+            ll, d1, d2 = family_terms(family, y, offset + b[g], phi)
+            grad = np.bincount(g, d1, G) - b / tau ** 2
+            hess = np.bincount(g, d2, G) - 1 / tau ** 2
+            step = -grad / hess
+            # halve the step of any group whose linear predictor leaves the valid range
+            scale = np.ones(G)
+            for _ in range(30):
+                bad = np.bincount(g, ~valid_eta(family, offset + (b + scale * step)[g]), G) > 0
+                if not bad.any():
+                    break
+                scale[bad] /= 2
+            b = b + scale * step
+            if np.max(np.abs(scale * step)) <= 1e-10 * (1 + np.max(np.abs(b))):
+                break
+
+        ll, d1, d2 = family_terms(family, y, offset + b[g], phi)
+        hess = np.bincount(g, d2, G) - 1 / tau ** 2
+        value = ll.sum() - np.sum(b ** 2) / (2 * tau ** 2) - G * np.log(tau) - 0.5 * np.sum(np.log(-hess))
+        return value, b, d2
+
+    def _unpack(self, theta):
+        p = self._X.shape[1]
+        beta = theta[:p] * self._scale
+        tau = np.exp(theta[p])
+        phi = np.exp(theta[p + 1]) if self.family in dispersion_families else 1.0
+        return beta, tau, phi
+
+    # GLM without random effects, for starting values
+    def _initial(self):
+        family, X, y = self.family, self._X, self._y
+        mu = np.clip(y.mean(), 0.01, 0.99) if family == 'binomial' else y.mean()
+        beta = np.zeros(X.shape[1])
+        beta[0] = link(family, mu)
+        for _ in range(25):
+            ll, d1, d2 = family_terms(family, y, X @ beta, 1.0)
+            step = np.linalg.solve(X.T @ (-d2[:, None] * X), X.T @ d1)
+            while not valid_eta(family, X @ (beta + step)).all():
+                step /= 2
+            beta = beta + step
+            if np.max(np.abs(step)) <= 1e-10 * (1 + np.max(np.abs(beta))):
+                break
+
+        eta = X @ beta
+        mu = {'binomial': special.expit, 'gaussian': lambda e: e}.get(family, lambda e: 1 / np.sqrt(e))(eta)
+        if family == 'inverse_gaussian':
+            phi = np.mean((y - mu) ** 2 / mu ** 3)
+        elif family == 'gaussian':
+            phi = np.var(y - mu)
+        else:
+            phi = 1.0
+
+        # spread of the groups' means on the link scale
+        means = np.bincount(self._groups, y, self._n_groups) / np.bincount(self._groups, minlength = self._n_groups)
+        if family == 'binomial':
+            means = np.clip(means, 0.01, 0.99)
+        tau = np.std(link(family, means))
+        if not np.isfinite(tau) or tau <= 0:
+            tau = 0.1 * abs(beta[0]) + 1e-3
+        return beta, tau, phi
+
+    def fit(self, factors = None, ordered = False, summarize = True, conf_int = 'Wald',
+            start = None, verbose = False, **kwargs):
+        if not factors:
+            raise ValueError("The native backend needs the factors dict")
+        response, terms, group = parse_formula(self.formula)
+        if group is None:
+            raise ValueError("The native backend fits (1|group) random-intercept models only")
+
+        self.factors = factors
+        self.ordered = ordered
+        self._terms = terms
+        names, self._X = design_matrix(self.data, self.formula, factors, ordered)
+        self._y = self.data[response].to_numpy(dtype = float)
+        self._groups, levels = pd.factorize(self.data[group])
+        self._n_groups = len(levels)
+
+        # start values: a previous fit's estimates (warm start) or a plain GLM
+        beta0, tau0, phi0 = self._initial()
+        if start is not None:
+            beta0 = np.asarray(start.get('fixef', beta0), dtype = float)
+            tau0 = start.get('tau', tau0)
+            phi0 = start.get('phi', phi0)
+
+        # optimize beta on the scale of the intercept; inverse_gaussian coefficients are ~1e-6
+        self._scale = abs(beta0[0]) if self.family == 'inverse_gaussian' else 1.0
+        theta0 = np.concatenate([beta0 / self._scale, [np.log(tau0)],
+                                 [np.log(phi0)] if self.family in dispersion_families else []])
+
+        # the modes are carried over between evaluations, so each inner solve is a few
+        # Newton steps; the objective is per observation to keep finite differences
+        # above rounding noise
+        modes = {'b': np.zeros(self._n_groups)}
+        n = len(self._y)
+
+        def objective(theta):
+            beta, tau, phi = self._unpack(theta)
+            value, b, _ = self._laplace(beta, tau, phi, modes['b'])
+            if not np.isfinite(value):
+                return 1e300
+            modes['b'] = b
+            return -value / n
+
+        started = time.perf_counter()
+        result = optimize.minimize(objective, theta0, method = 'BFGS')
+        self.fit_time = time.perf_counter() - started
+        self.optinfo = {'nit': int(result.nit), 'nfev': int(result.nfev),
+                        'success': bool(result.success), 'message': str(result.message)}
+
+        beta, tau, phi = self._unpack(result.x)
+        value, b, d2 = self._laplace(beta, tau, phi, modes['b'])
+        self.warnings = []
+        if not result.success:
+            self.warnings.append(f"Model failed to converge: {result.message}")
+        if tau < 1e-4 * max(abs(beta[0]), 1e-8):
+            self.warnings.append("boundary (singular) fit: random intercept variance is ~0")
+
+        # fixed-effect covariance with the random intercepts profiled out
+        w = -d2
+        S = np.column_stack([np.bincount(self._groups, w * self._X[:, k], self._n_groups)
+                             for k in range(self._X.shape[1])])
+        info = self._X.T @ (w[:, None] * self._X) - (S.T / (np.bincount(self._groups, w, self._n_groups) + 1 / tau ** 2)) @ S
+        self.vcov = np.linalg.inv(info)
+
+        se = np.sqrt(np.diag(self.vcov))
+        z = stats.norm.ppf(0.975)
+        self.coefs = pd.DataFrame({'Estimate': beta, '2.5_ci': beta - z * se, '97.5_ci': beta + z * se,
+                                   'SE': se, 'Z-stat': beta / se,
+                                   'P-val': 2 * stats.norm.sf(np.abs(beta / se))}, index = names)
+        self.coefs['Sig'] = sig_stars(self.coefs['P-val'].to_numpy())
+
+        n_params = len(beta) + 1 + (self.family in dispersion_families)
+        self.logLike = value
+        self.AIC = -2 * value + 2 * n_params
+        self.BIC = -2 * value + np.log(len(self._y)) * n_params
+        self.ranef_var = tau ** 2
+        self.dispersion = phi
+        self.ranef = pd.Series(b, index = levels, name = '(Intercept)')
+        self.start = {'fixef': beta, 'tau': tau, 'phi': phi}
+        self.fitted = True
+
+        if summarize:
+            print(f"Native GLMM (Laplace), family {self.family}: {self.formula}")
+            print(self.coefs.round(3))
+            for warning in self.warnings:
+                print(warning)
+        return self.coefs
+
+    def estimates(self):
+        return list(self.coefs.index), self.coefs['Estimate'].to_numpy(), self.vcov
+
+    # Type III Wald chi-square test of every term
+    def anova(self):
+        if not self.fitted:
+            raise ValueError("Model must be fit before ANOVA table can be generated!")
+        self.anova_results = wald_anova(list(self.coefs.index), self.coefs['Estimate'].to_numpy(),
+                                        self.vcov, self._terms, self.factors)
+        return self.anova_results
+
+    def post_hoc(self, marginal_vars, grouping_vars = None, p_adjust = 'bonf', summarize = True):
+        if grouping_vars:
+            raise ValueError("grouping_vars are not available in the native backend")
+        if p_adjust == 'tukey':
+            raise ValueError("tukey adjustment is not available in the native backend; use bonf, holm or fdr")
+        if not isinstance(marginal_vars, list):
+            marginal_vars = [marginal_vars]
+        names, beta, vcov = self.estimates()
+        _, self.marginal_estimates, self.marginal_contrasts = batch_post_hoc(
+            names, beta, vcov, self.factors, [marginal_vars], p_adjust, self.ordered)[0]
+        return self.marginal_estimates, self.marginal_contrasts
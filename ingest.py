@@ -0,0 +1,146 @@
+import argparse
+import glob
+import os
+import shutil
+import time
+
+import pandas as pd
+
+import instrument
+import pipeline
+from aggregate import DESIGN, build_cube, cube_path, load_cube
+from design import set_levels
+from model_runner import FACTORS
+from preprocessing import cache_path, compact, load_clean, read_export, sessions_dir, stream_clean, write_cache
+from rt_filter import filter_export, filter_rt, groupings
+
+
+# {path: [data source names]}; sources reading the same file share one session file
+def source_files(spec):
+    files = {}
+    for name, source in spec['data'].items():
+        files.setdefault(source['path'], []).append(name)
+    return files
+
+
+# the cubes the spec's figures draw from this data source: {measure: RT filter options}
+def source_cubes(spec, name):
+    source = spec['data'][name]
+    options = pipeline.filter_options(source)
+    return {fig['measure']: options for fig in pipeline.figure_specs(spec, name).values()}
+
+
+# a filter by subject (or by a design cell within subject) gives the same result
+# for a subject whether or not other subjects are present
+def per_subject(options):
+    return not options or 'Subject' in groupings.get(options['by'], options['by'])
+
+
+# Subject x design cells are independent, so a new subject's cells are added to the
+# cube as they are, in the order build_cube() gives on the full data
+def extend_cube(cube, new_cube, subjects):
+    cube = pd.concat([cube, new_cube], ignore_index = True)
+    cube['Subject'] = pd.Categorical(cube['Subject'], categories = subjects)
+    return set_levels(cube, FACTORS).sort_values(DESIGN, ignore_index = True)
+
+
+# the session's file for a data file, as that file's producer would write it: rt
+# files get the trials filter-rt keeps from the export (its default cutoffs), written
+# as filter-rt writes them; exports are copied as they are
+def write_session(export, export_path, path, kinds):
+    if 'rt' in kinds and len(kinds) > 1:
+        raise ValueError(f"{path} is read both as rt and as {sorted(kinds - {'rt'})} data")
+    session = os.path.join(sessions_dir(path), os.path.basename(export_path))
+    os.makedirs(sessions_dir(path), exist_ok = True)
+    tmp = session + '.tmp'
+    if 'rt' in kinds:
+        rows, _ = filter_export(export)
+        rows.to_csv(tmp, sep = ';', index = False)
+    else:
+        shutil.copyfile(export_path, tmp)
+    os.replace(tmp, session)
+    return session
+
+
+# adds one session export (raw_data_all.csv schema) to every data file of the spec as
+# a file of its own (preprocessing.sessions_dir), and carries the cleaned-data caches
+# and the figures' cubes over to the new source contents, so the next pipeline run
+# parses only the session; returns {path: (session file, rows)}
+def add_export(spec, export_path):
+    session = os.path.basename(export_path)
+    for path in source_files(spec):
+        if glob.has_magic(path):
+            raise ValueError(f"{path} is a glob of files; add the session's export to it as a new file instead")
+        if os.path.exists(os.path.join(sessions_dir(path), session)):
+            raise ValueError(f"{session} has already been added to {path}")
+    export = read_export(export_path)
+    subjects = set(export['Subject'].unique())
+
+    # everything is checked and loaded under the old file hashes before any file is added
+    before = {}
+    for path, names in source_files(spec).items():
+        frames = {name: load_clean(path, spec['data'][name]['kind']) for name in names}
+        for name, df in frames.items():
+            present = subjects & set(df['Subject'].cat.categories)
+            if present:
+                raise ValueError(f"Subject(s) {sorted(map(str, present))} already in {path} ({name})")
+        cubes = {name: {measure: load_cube(path, spec['data'][name]['kind'], measure, options)
+                        for measure, options in source_cubes(spec, name).items()}
+                 for name in names}
+        before[path] = (frames, cubes)
+
+    added = {}
+    for path, (frames, cubes) in before.items():
+        names = list(frames)
+        file = write_session(export, export_path, path, {spec['data'][name]['kind'] for name in names})
+
+        for name in names:
+            kind = spec['data'][name]['kind']
+            # read back from the session file, as a cold load of the source reads it
+            new, n_rows = stream_clean(file, kind)
+            df = compact(pd.concat([frames[name], new], ignore_index = True))
+            write_cache(df, cache_path(path, kind))
+
+            options = pipeline.filter_options(spec['data'][name])
+            if not per_subject(options):
+                # cutoffs pooled over subjects change for everyone; load_cube() rebuilds it
+                continue
+            if options:
+                new, _ = filter_rt(new, **options)
+            for measure, cube in cubes[name].items():
+                cube = extend_cube(cube, build_cube(new, measure), df['Subject'].cat.categories)
+                write_cache(cube, cube_path(path, kind, measure, options))
+        added[path] = (file, n_rows)
+    return added
+
+
+# interim analysis after a session: add each export, then rerun the pipeline;
+# models refit from their previous estimates and figures redraw from the updated cubes
+def ingest(spec_path, export_paths, n_workers = None, backend = None):
+    spec = pipeline.load_spec(spec_path)
+    for export_path in export_paths:
+        started = time.perf_counter()
+        with instrument.stage('add_export') as stage:
+            added = add_export(spec, export_path)
+            stage['rows_out'] = sum(n for _, n in added.values())
+        for path, (file, n) in added.items():
+            print(f"{export_path}: {n} rows -> {file} ({path})")
+        print(f"added in {time.perf_counter() - started:.2f} s")
+    return pipeline.run(spec_path, n_workers = n_workers, backend = backend)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Add new subjects\' sessions and rerun the analyses.')
+    parser.add_argument('exports', nargs = '+', help = 'session exports in the raw_data_all.csv format')
+    parser.add_argument('--spec', default = pipeline.SPEC_PATH)
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--backend', choices = ['lme4', 'native'], default = None,
+                        help = 'override the model backend of every spec model')
+    args = parser.parse_args()
+
+    for stage in ingest(args.spec, args.exports, args.workers, args.backend):
+        print(stage)
+
+
+if __name__ == '__main__':
+    main()
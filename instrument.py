@@ -0,0 +1,125 @@
+import contextlib
+import datetime
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# the run being recorded; stage() is a no-op when nothing is recording
+_run = None
+
+
+# process high-water mark in MB (ru_maxrss is KB on Linux, bytes on macOS)
+def peak_rss_mb(who = 'self'):
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    return usage.ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+
+
+# starts recording; trace_memory adds per-stage tracemalloc peaks (slower),
+# profile writes a cProfile dump of the whole run to that path
+def start(command, trace_memory = False, profile = None):
+    global _run
+    _run = {'report': {'command': command,
+                       'argv': sys.argv,
+                       'started': datetime.datetime.now().isoformat(timespec = 'seconds'),
+                       'stages': [],
+                       'models': {}},
+            'wall': time.perf_counter(),
+            'cpu': time.process_time(),
+            'stack': [],
+            'n_stages': 0,
+            'trace_memory': trace_memory,
+            'profile': None}
+    if trace_memory:
+        tracemalloc.start()
+    if profile:
+        import cProfile
+
+        _run['profile'] = (cProfile.Profile(), profile)
+        _run['profile'][0].enable()
+
+
+# times one stage of the run; the yielded dict takes extra fields such as rows_out
+@contextlib.contextmanager
+def stage(name, rows_in = None):
+    if _run is None:
+        yield {}
+        return
+
+    # stages are stored when they end; 'order' puts them back in start order
+    record = {'stage': name, 'depth': len(_run['stack']), 'order': _run['n_stages']}
+    _run['n_stages'] += 1
+    if rows_in is not None:
+        record['rows_in'] = int(rows_in)
+    if _run['trace_memory']:
+        # keep the enclosing stage's peak before resetting it for this one
+        if _run['stack']:
+            parent = _run['stack'][-1]
+            parent['_peak'] = max(parent.get('_peak', 0), tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    _run['stack'].append(record)
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_seconds'] = time.perf_counter() - wall
+        record['cpu_seconds'] = time.process_time() - cpu
+        record['peak_rss_mb'] = peak_rss_mb()
+        _run['stack'].pop()
+        if _run['trace_memory']:
+            peak = max(tracemalloc.get_traced_memory()[1], record.pop('_peak', 0))
+            record['peak_traced_mb'] = peak / 1024 ** 2
+            if _run['stack']:
+                parent = _run['stack'][-1]
+                parent['_peak'] = max(parent.get('_peak', 0), peak)
+        _run['report']['stages'].append(record)
+
+
+# per-model numbers measured inside the worker processes (see model_runner.fit_job)
+def record_model(name, timings, resources, optimizer = None):
+    if _run is not None:
+        _run['report']['models'][name] = dict(timings, **resources)
+        if optimizer is not None:
+            _run['report']['models'][name]['optimizer'] = optimizer
+
+
+def default_path(command, out_dir = os.path.join('results', 'reports')):
+    stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    return os.path.join(out_dir, f'{command}-{stamp}.json')
+
+
+# stops recording and returns the report; writes it as JSON when path is given
+def finish(path = None):
+    global _run
+    if _run is None:
+        return None
+    run, _run = _run, None
+
+    report = run['report']
+    report['wall_seconds'] = time.perf_counter() - run['wall']
+    report['cpu_seconds'] = time.process_time() - run['cpu']
+    report['peak_rss_mb'] = peak_rss_mb()
+    # worker processes that have exited, e.g. the model-fitting pool
+    report['children_peak_rss_mb'] = peak_rss_mb('children')
+    if run['trace_memory']:
+        tracemalloc.stop()
+    if run['profile']:
+        profiler, profile_path = run['profile']
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+        report['profile'] = profile_path
+    report['stages'].sort(key = lambda record: record.pop('order'))
+
+    if path:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent = 1)
+    return report
@@ -0,0 +1,378 @@
+import contextlib
+import functools
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+import bootstrap
+import instrument
+import result_cache
+import row_index
+from design import coef_names, design_matrix, parse_formula, set_levels
+
+# factor levels passed to fit(); the first level of each list is the reference
+FACTORS = {"Awareness": ['Seen', 'Unseen'],
+           "Attention": ["Attended", "Unattended"],
+           "Region": ["FEF", "Vertex"],
+           "Task": ["Alerting", "Orienting"]
+           }
+
+
+# one independent model: formula + subset + family + post-hoc comparisons
+# subset is a {column: level} dict so jobs stay picklable
+# conf_int='boot' runs a chunked parametric bootstrap with n_boot resamples
+# post_hoc_engine='batch' computes every post-hoc set from one estimates export;
+# 'emmeans' calls model.post_hoc() once per set
+# backend='lme4' fits through pymer4/R; 'native' uses the Laplace GLMM in glmm.py,
+# which needs no R and is meant for quick exploratory runs
+def model_job(name, formula, family, subset = None, factors = None, post_hoc = (),
+              p_adjust = 'bonf', conf_int = 'Wald', ordered = True, n_boot = 500, seed = 0,
+              post_hoc_engine = 'batch', backend = 'lme4'):
+    return {'name': name,
+            'formula': formula,
+            'family': family,
+            'subset': dict(subset or {}),
+            'factors': dict(factors or FACTORS),
+            'post_hoc': [list(marginal_vars) for marginal_vars in post_hoc],
+            'p_adjust': p_adjust,
+            'conf_int': conf_int,
+            'ordered': ordered,
+            'n_boot': n_boot,
+            'seed': seed,
+            'post_hoc_engine': post_hoc_engine,
+            'backend': backend
+            }
+
+
+# index is row_index.build(df): with it, the subset is a slice of the sorted frame
+def subset_frame(df, subset, index = None):
+    rows = row_index.lookup(df, index, subset)
+    if rows is not None:
+        return rows
+    for column, level in subset.items():
+        df = df[df[column] == level]
+    return df
+
+
+def model_class(backend):
+    if backend == 'native':
+        from glmm import GLMM
+        return GLMM
+    if backend == 'lme4':
+        from pymer4.models import Lmer
+        return Lmer
+    raise ValueError(f"Unknown backend '{backend}'; use 'lme4' or 'native'")
+
+
+# pymer4's Lmer.fit() takes no start values, so while fitting, the lme4/lmerTest
+# packages it imports are wrapped to pass start = list(theta, fixef) to glmer() and
+# start = list(theta) to lmer()
+@contextlib.contextmanager
+def lme4_start(start):
+    from rpy2 import robjects
+
+    module = sys.modules['pymer4.models.Lmer']
+    importr = module.importr
+    theta = robjects.FloatVector(start['theta'])
+    values = {'glmer': robjects.r['list'](theta = theta, fixef = robjects.FloatVector(start['fixef'])),
+              'lmer': robjects.r['list'](theta = theta)}
+
+    class Package:
+        def __init__(self, package):
+            self._package = package
+
+        def __getattr__(self, name):
+            attr = getattr(self._package, name)
+            return functools.partial(attr, start = values[name]) if name in values else attr
+
+    module.importr = lambda name, *args, **kwargs: Package(importr(name, *args, **kwargs))
+    try:
+        yield
+    finally:
+        module.importr = importr
+
+
+# the fitted parameters in the form fit() takes back as start values
+def fit_start(model, backend):
+    if backend == 'native':
+        return {'backend': backend, 'fixef': list(model.start['fixef']),
+                'tau': model.start['tau'], 'phi': model.start['phi']}
+    from rpy2 import robjects
+
+    theta = robjects.r('lme4::getME')(model.model_obj, 'theta')
+    # random-intercept SD and sigma^2 (the dispersion), as the native backend's tau and phi
+    sd, sigma = robjects.r('function(m) c(attr(lme4::VarCorr(m)[[1]], "stddev")[1], sigma(m))')(model.model_obj)
+    return {'backend': backend, 'fixef': list(model.coefs['Estimate']), 'theta': list(theta),
+            'tau': sd, 'phi': sigma ** 2}
+
+
+# starts a refit (e.g. after new subjects were added) from an earlier fit of the same
+# model; ignored when the fixed-effect columns have changed since
+def warm_start(job, previous):
+    start = (previous or {}).get('start')
+    if start is None:
+        return job
+    _, terms, _ = parse_formula(job['formula'])
+    if list(previous['coefs'].index) != coef_names(terms, job['factors']):
+        return job
+    return dict(job, start = dict(start, source = 'previous fit'))
+
+
+# index of the model a subset model is nested in: fitted on every row, with the same
+# response, family, grouping and backend, and every fixed-effect term of the subset model
+def parent_index(job, jobs):
+    if not job['subset']:
+        return None
+    response, terms, group = parse_formula(job['formula'])
+    for i, other in enumerate(jobs):
+        other_response, other_terms, other_group = parse_formula(other['formula'])
+        if not other['subset'] and (other_response, other_group) == (response, group) \
+                and (other['family'], other['backend']) == (job['family'], job['backend']) \
+                and set(terms) <= set(other_terms):
+            return i
+    return None
+
+
+# start values for a subset model from its parent's fit: the parent's linear predictor
+# on the subset's rows, projected onto the subset model's design (exact when both
+# designs are saturated); the random-effect parameters carry over as they are
+def subset_start(parent, start, job, data):
+    data = set_levels(data, job['factors'])
+    _, X_parent = design_matrix(data, parent['formula'], parent['factors'], parent['ordered'])
+    _, X = design_matrix(data, job['formula'], job['factors'], job['ordered'])
+    fixef, *_ = np.linalg.lstsq(X, X_parent @ np.asarray(start['fixef']), rcond = None)
+    return dict(start, fixef = list(fixef), source = parent['name'])
+
+
+# optimizer work of a fit: native iterations/objective evaluations from BFGS, lme4
+# deviance evaluations of the final optimization (lme4 does not count iterations)
+def optimizer_info(model, backend):
+    if backend == 'native':
+        return {'iterations': model.optinfo['nit'], 'evaluations': model.optinfo['nfev']}
+    from rpy2 import robjects
+
+    feval = robjects.r('function(m) m@optinfo$feval')(model.model_obj)
+    return {'iterations': None, 'evaluations': int(feval[0])}
+
+
+# runs inside a worker process, each with its own embedded R session (lme4 backend)
+# timings holds the seconds spent in each step and resources the worker's CPU time,
+# time inside R (lme4 backend, including the rpy2 conversions) and peak RSS
+def fit_job(job, data):
+    timings = {}
+    cpu = time.process_time()
+    started = time.perf_counter()
+    # categorical columns must already have the job's level order: pymer4's own
+    # astype(CategoricalDtype(levels)) keeps the old order when only the order differs
+    data = set_levels(data, job['factors'])
+    # family goes to the constructor; Lmer.fit() silently ignores it
+    model = model_class(job['backend'])(job['formula'], data = data, family = job['family'])
+    # bootstrap intervals are computed in parallel chunks by run_jobs; the native
+    # backend has no bootstrap and reports Wald intervals
+    conf_int = 'Wald' if job['conf_int'] == 'boot' else job['conf_int']
+    fit = functools.partial(model.fit, factors = job['factors'], ordered = job['ordered'],
+                            summarize = False, conf_int = conf_int)
+    # start values from another backend are on another scale
+    start = job.get('start')
+    if start is None or start['backend'] != job['backend']:
+        start = None
+        fit()
+    elif job['backend'] == 'native':
+        fit(start = start)
+    else:
+        with lme4_start(start):
+            fit()
+    timings['fit'] = time.perf_counter() - started
+    optimizer = dict(optimizer_info(model, job['backend']), seconds = timings['fit'],
+                     start = 'default' if start is None else start.get('source', 'given'))
+
+    started = time.perf_counter()
+    anova = model.anova()
+    timings['anova'] = time.perf_counter() - started
+
+    post_hoc = []
+    if job['post_hoc'] and job['post_hoc_engine'] == 'batch':
+        from posthoc import batch_post_hoc, export_estimates
+
+        started = time.perf_counter()
+        names, beta, vcov = export_estimates(model)
+        timings['export'] = time.perf_counter() - started
+        started = time.perf_counter()
+        post_hoc = batch_post_hoc(names, beta, vcov, job['factors'], job['post_hoc'],
+                                  job['p_adjust'], job['ordered'])
+    else:
+        started = time.perf_counter()
+        for marginal_vars in job['post_hoc']:
+            marginal_estimates, comparisons = model.post_hoc(
+                marginal_vars = marginal_vars, p_adjust = job['p_adjust']
+            )
+            post_hoc.append((marginal_vars, marginal_estimates, comparisons))
+    timings['post_hoc'] = time.perf_counter() - started
+
+    in_r = ['fit', 'anova', 'export'] if job['post_hoc_engine'] == 'batch' else ['fit', 'anova', 'post_hoc']
+    resources = {'cpu_seconds': time.process_time() - cpu,
+                 'r_seconds': sum(timings.get(step, 0) for step in in_r) if job['backend'] == 'lme4' else 0.0,
+                 'peak_rss_mb': instrument.peak_rss_mb()}
+
+    return {'name': job['name'],
+            'coefs': model.coefs,
+            'anova': anova,
+            'post_hoc': post_hoc,
+            'timings': timings,
+            'resources': resources,
+            'optimizer': optimizer,
+            'start': fit_start(model, job['backend'])
+            }
+
+
+# fits jobs on an open process pool (a local one or the model server's); results come
+# back in job order. A subset model without start values of its own waits for the fit
+# of the model it is nested in and starts from it
+def fit_jobs(jobs, subsets, pool, warm = True):
+    jobs = [dict(job) for job in jobs]
+    results = [None] * len(jobs)
+    children = {}
+    for i, job in enumerate(jobs):
+        parent = parent_index(job, jobs) if warm and 'start' not in job else None
+        if parent is not None:
+            children.setdefault(parent, []).append(i)
+    waiting = {i for group in children.values() for i in group}
+
+    futures = {}
+    boots = {}
+
+    def submit(i):
+        futures[pool.submit(fit_job, jobs[i], subsets[i])] = i
+
+    # bootstrap chunks share the pool with the model fits; a parent's chunks are
+    # queued after its children so they do not wait behind the resamples
+    def submit_boot(i):
+        if jobs[i]['conf_int'] == 'boot' and jobs[i]['backend'] == 'lme4':
+            boots[i] = bootstrap.submit_bootstrap(pool, jobs[i], subsets[i],
+                                                  jobs[i]['n_boot'], jobs[i]['seed'])
+
+    for i in range(len(jobs)):
+        if i not in waiting:
+            submit(i)
+    for i in range(len(jobs)):
+        if i not in children:
+            submit_boot(i)
+    while futures:
+        finished, _ = wait(futures, return_when = FIRST_COMPLETED)
+        for future in finished:
+            i = futures.pop(future)
+            results[i] = future.result()
+            for child in children.get(i, []):
+                jobs[child]['start'] = subset_start(jobs[i], results[i]['start'], jobs[child], subsets[child])
+                submit(child)
+            if i in children:
+                submit_boot(i)
+
+    # time still spent waiting on resamples once every fit is back
+    with instrument.stage('bootstrap'):
+        for i, (directory, chunks) in boots.items():
+            for chunk in chunks:
+                chunk.result()
+            ci = bootstrap.percentile_ci(directory, jobs[i]['n_boot'])
+            results[i]['coefs'] = bootstrap.apply_boot_ci(results[i]['coefs'], ci)
+    return results
+
+
+# fits every job in its own process; results come back in job order
+# jobs whose results are already cached are returned without starting R
+# backend overrides every job's backend, e.g. 'native' for a quick exploratory pass
+# warm starts subset models from the fit of the model they are nested in
+# server is the address of a model server (model_server.py) to fit on instead of a
+# new pool; 'auto' uses the default one if it is running, None never uses one
+def run_jobs(jobs, df, n_workers = None, cache = True, backend = None, warm = True, server = 'auto'):
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = max(1, n_workers)
+    jobs = [dict(job) if backend is None else dict(job, backend = backend) for job in jobs]
+
+    # subset in the parent so each worker only receives the rows it needs
+    with instrument.stage('subset', rows_in = len(df)) as stage:
+        index = row_index.build(df)
+        subsets = [subset_frame(df, job['subset'], index) for job in jobs]
+        stage['rows_out'] = sum(len(data) for data in subsets)
+
+    results = [None] * len(jobs)
+    keys = [None] * len(jobs)
+    if cache:
+        with instrument.stage('result_cache') as stage:
+            for i, (job, data) in enumerate(zip(jobs, subsets)):
+                keys[i] = result_cache.result_key(job, data)
+                results[i] = result_cache.get(keys[i])
+                if results[i] is not None:
+                    results[i]['name'] = job['name']
+            stage['hits'] = sum(result is not None for result in results)
+    todo = [i for i, result in enumerate(results) if result is None]
+    if not todo:
+        return results
+
+    # a subset model whose parent was cached starts from the cached fit
+    for i in todo:
+        parent = parent_index(jobs[i], jobs) if warm and 'start' not in jobs[i] else None
+        if parent is not None and results[parent] is not None and results[parent].get('start') is not None:
+            jobs[i]['start'] = subset_start(jobs[parent], results[parent]['start'], jobs[i], subsets[i])
+
+    address = None
+    if server:
+        import model_server
+        address = model_server.find(model_server.ADDRESS if server == 'auto' else server)
+
+    with instrument.stage('models') as stage:
+        stage['fitted'] = len(todo)
+        if address:
+            stage['server'] = address
+            fitted = model_server.fit_jobs(address, [jobs[i] for i in todo], [subsets[i] for i in todo], warm)
+        else:
+            # spawn, not fork: R must be started fresh in every worker
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers = n_workers, mp_context = context) as pool:
+                fitted = fit_jobs([jobs[i] for i in todo], [subsets[i] for i in todo], pool, warm)
+    for i, result in zip(todo, fitted):
+        results[i] = result
+        instrument.record_model(jobs[i]['name'], result['timings'], result['resources'], result['optimizer'])
+
+    if cache:
+        for i in todo:
+            result_cache.put(keys[i], results[i])
+    return results
+
+
+# fits every job with both backends (Wald intervals, no post-hoc) and compares the
+# fixed effects; a native estimate passes if it is within tolerance lme4 SEs
+def validate_backend(jobs, df, n_workers = None, tolerance = 0.1):
+    import pandas as pd
+
+    jobs = [dict(job, conf_int = 'Wald', post_hoc = []) for job in jobs]
+    native = run_jobs(jobs, df, n_workers, backend = 'native')
+    reference = run_jobs(jobs, df, n_workers, backend = 'lme4')
+
+    tables = {}
+    for job, fast, ref in zip(jobs, native, reference):
+        table = pd.DataFrame({'native': fast['coefs']['Estimate'],
+                              'lme4': ref['coefs']['Estimate'],
+                              'lme4_SE': ref['coefs']['SE']})
+        table['diff_SE'] = (table['native'] - table['lme4']) / table['lme4_SE']
+        table['ok'] = table['diff_SE'].abs() <= tolerance
+        tables[job['name']] = table
+    return tables
+
+
+def print_results(results):
+    for result in results:
+        print(f"## model: {result['name']}")
+        if 'optimizer' in result:
+            optimizer = result['optimizer']
+            print(f"start: {optimizer['start']}, {optimizer['evaluations']} evaluations, "
+                  f"{optimizer['seconds']:.2f} s")
+        print(result['coefs'])
+        print(result['anova'])
+        for marginal_vars, marginal_estimates, comparisons in result['post_hoc']:
+            print(comparisons)
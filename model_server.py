@@ -0,0 +1,214 @@
+import argparse
+import collections
+import hashlib
+import multiprocessing
+import os
+import secrets
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.connection import Client, Listener
+
+import model_runner
+
+# a long-lived pool of model workers, each with R and lme4/lmerTest/emmeans loaded once;
+# scripts hand their jobs to it through model_runner.run_jobs (server = 'auto') and so
+# skip R start-up and repeated pandas -> R conversions of the same data
+ADDRESS = os.path.join('.cache', 'model_server', 'server.sock')
+# requests are unpickled, so only the owner may connect: the socket is created owner-only
+# (in an owner-only directory for the default address) and each server has a random
+# key, readable only by its owner, in <address>.key
+KEY_BYTES = 32
+# converted R data frames kept per worker; the least recently used is dropped first
+MAX_FRAMES = 32
+
+_frames = collections.OrderedDict()
+
+
+# pymer4's pandas -> R data.frame conversion, memoized by the frame's contents and
+# dtypes (the category order becomes the R factor levels, so it is part of the key)
+def cached_conversion(convert):
+    from result_cache import data_fingerprint
+
+    def pandas2R(df):
+        key = data_fingerprint(df) + hashlib.sha256(repr(list(df.dtypes)).encode()).hexdigest()
+        if key in _frames:
+            _frames.move_to_end(key)
+        else:
+            _frames[key] = convert(df)
+            if len(_frames) > MAX_FRAMES:
+                _frames.popitem(last = False)
+        return _frames[key]
+    return pandas2R
+
+
+# pool initializer: starts R and loads the packages every fit needs, once per worker
+def warm_up():
+    # imported only to load them (with numpy, pandas and scipy) now rather than in the first fit
+    import glmm  # noqa: F401
+    import posthoc  # noqa: F401
+
+    try:
+        # loads pymer4.models.Lmer, whose pandas2R is wrapped below
+        from pymer4.models import Lmer  # noqa: F401
+        from rpy2.robjects.packages import importr
+    except ImportError:
+        # no R here: the server still saves the start-up of native-backend workers
+        return
+    for package in ('lme4', 'lmerTest', 'emmeans'):
+        importr(package)
+    module = sys.modules['pymer4.models.Lmer']
+    module.pandas2R = cached_conversion(module.pandas2R)
+
+
+def key_path(address):
+    return address + '.key'
+
+
+def write_key(address):
+    path = key_path(address)
+    if os.path.exists(path):
+        os.remove(path)
+    key = secrets.token_bytes(KEY_BYTES)
+    # created with owner-only permissions, never readable by others even briefly
+    with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as f:
+        f.write(key)
+    return key
+
+
+def read_key(address):
+    with open(key_path(address), 'rb') as f:
+        return f.read()
+
+
+def worker_pid():
+    return os.getpid()
+
+
+def start_pool(n_workers):
+    context = multiprocessing.get_context('spawn')
+    pool = ProcessPoolExecutor(max_workers = n_workers, mp_context = context, initializer = warm_up)
+    # every worker loads R now rather than on the first request
+    for future in [pool.submit(worker_pid) for _ in range(n_workers)]:
+        future.result()
+    return pool
+
+
+def handle(message, pool, stats):
+    op, *args = message
+    if op == 'ping':
+        return 'ok', dict(stats, pid = os.getpid())
+    if op == 'fit':
+        jobs, subsets, warm = args
+        started = time.perf_counter()
+        results = model_runner.fit_jobs(jobs, subsets, pool, warm)
+        stats['requests'] += 1
+        stats['jobs'] += len(jobs)
+        stats['fit_seconds'] += time.perf_counter() - started
+        return 'ok', results
+    return 'error', f"Unknown request '{op}'"
+
+
+# answers one request at a time; each request's jobs run in parallel on the pool
+def serve(address = ADDRESS, n_workers = None):
+    if find(address):
+        raise RuntimeError(f"A model server is already running at {address}")
+    if os.path.exists(address):
+        # left behind by a server that did not shut down cleanly
+        os.remove(address)
+    directory = os.path.dirname(address) or '.'
+    if not os.path.isdir(directory):
+        os.makedirs(directory, mode = 0o700)
+
+    n_workers = n_workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    pool = start_pool(n_workers)
+    print(f"{n_workers} workers ready in {time.perf_counter() - started:.1f} s; listening on {address}")
+
+    stats = {'workers': n_workers, 'started': time.time(), 'requests': 0, 'jobs': 0, 'fit_seconds': 0.0}
+    authkey = write_key(address)
+    # the socket is bound owner-only rather than chmod-ed afterwards
+    umask = os.umask(0o077)
+    try:
+        listener = Listener(address, 'AF_UNIX', authkey = authkey)
+    finally:
+        os.umask(umask)
+    with listener:
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, multiprocessing.AuthenticationError):
+                continue
+            with conn:
+                try:
+                    message = conn.recv()
+                except EOFError:
+                    continue
+                if message[0] == 'shutdown':
+                    conn.send(('ok', stats))
+                    break
+                try:
+                    reply = handle(message, pool, stats)
+                except BrokenProcessPool:
+                    # a worker died (e.g. R crashed); later requests get a fresh pool
+                    reply = 'error', traceback.format_exc()
+                    pool.shutdown(wait = False)
+                    pool = start_pool(n_workers)
+                except Exception:
+                    reply = 'error', traceback.format_exc()
+                conn.send(reply)
+    pool.shutdown()
+    os.remove(key_path(address))
+    return stats
+
+
+def request(address, *message):
+    with Client(address, 'AF_UNIX', authkey = read_key(address)) as conn:
+        conn.send(message)
+        status, payload = conn.recv()
+    if status != 'ok':
+        raise RuntimeError(f"Model server at {address} failed:\n{payload}")
+    return payload
+
+
+# the address if a server is answering there, else None
+def find(address = ADDRESS):
+    if address is None or not os.path.exists(address):
+        return None
+    try:
+        request(address, 'ping')
+    except (OSError, EOFError, multiprocessing.AuthenticationError):
+        return None
+    return address
+
+
+# model_runner.fit_jobs on the server's pool
+def fit_jobs(address, jobs, subsets, warm = True):
+    return request(address, 'fit', jobs, subsets, warm)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Keep R and lme4 loaded in a pool of model workers.')
+    parser.add_argument('--address', default = ADDRESS, help = 'Unix socket path')
+    parser.add_argument('--workers', type = int, default = None)
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--status', action = 'store_true', help = 'report on a running server')
+    group.add_argument('--stop', action = 'store_true', help = 'shut a running server down')
+    args = parser.parse_args(argv)
+
+    if args.status or args.stop:
+        if not find(args.address):
+            print(f"no model server at {args.address}")
+            return 1
+        stats = request(args.address, 'shutdown' if args.stop else 'ping')
+        print(f"{stats['workers']} workers, {stats['requests']} requests, {stats['jobs']} jobs, "
+              f"{stats['fit_seconds']:.1f} s fitting, up {time.time() - stats['started']:.0f} s")
+        return 0
+    serve(args.address, args.workers)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,257 @@
+import argparse
+import graphlib
+import hashlib
+import json
+import os
+import pickle
+
+import instrument
+import preprocessing
+import result_cache
+from model_runner import FACTORS, model_job, run_jobs, print_results, warm_start
+
+SPEC_PATH = 'analysis_spec.json'
+STATE_PATH = os.path.join('.cache', 'pipeline_state.json')
+
+sections = {'data': 'data', 'model': 'models', 'figure': 'figures'}
+
+
+def load_spec(path = SPEC_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+def with_backend(spec, backend = None):
+    if backend is not None:
+        for entry in spec['models'].values():
+            entry['backend'] = backend
+    return spec
+
+
+# factors can be listed by name; levels come from FACTORS
+def resolve_factors(factors):
+    if isinstance(factors, dict):
+        return factors
+    return {name: FACTORS[name] for name in factors}
+
+
+def spec_job(name, entry):
+    entry = {k: v for k, v in entry.items() if k != 'data'}
+    entry['factors'] = resolve_factors(entry.get('factors', list(FACTORS)))
+    return model_job(name, **entry)
+
+
+def model_jobs(spec, data):
+    return [spec_job(name, entry) for name, entry in spec['models'].items() if entry['data'] == data]
+
+
+def figure_specs(spec, data):
+    return {name: fig for name, fig in spec['figures'].items() if fig['data'] == data}
+
+
+# returns cube_for(fig), loading each (data source, measure) cube once
+def cube_loader(spec):
+    from aggregate import load_cube
+
+    cubes = {}
+
+    def cube_for(fig):
+        key = (fig['data'], fig['measure'])
+        if key not in cubes:
+            source = spec['data'][fig['data']]
+            cubes[key] = load_cube(source['path'], source['kind'], fig['measure'], filter_options(source))
+        return cubes[key]
+    return cube_for
+
+
+def split(stage):
+    kind, name = stage.split(':', 1)
+    return kind, name
+
+
+def entry(spec, stage):
+    kind, name = split(stage)
+    return spec[sections[kind]][name]
+
+
+# data stages have no inputs; models and figures depend on their data source
+def build_graph(spec):
+    graph = {f'data:{name}': set() for name in spec['data']}
+    for kind in ('model', 'figure'):
+        for name, item in spec[sections[kind]].items():
+            graph[f'{kind}:{name}'] = {f"data:{item['data']}"}
+    return graph
+
+
+# a stage's signature covers its own spec entry and the signatures of its inputs,
+# so a changed source file or spec entry invalidates everything downstream of it
+def signatures(spec, graph):
+    sigs = {}
+    for stage in graphlib.TopologicalSorter(graph).static_order():
+        h = hashlib.sha256(json.dumps(entry(spec, stage), sort_keys = True).encode())
+        if stage.startswith('data:'):
+            h.update(preprocessing.file_hash(entry(spec, stage)['path']).encode())
+        if stage.startswith('model:'):
+            h.update(str(result_cache.RESULT_VERSION).encode())
+        for dep in sorted(graph[stage]):
+            h.update(sigs[dep].encode())
+        sigs[stage] = h.hexdigest()
+    return sigs
+
+
+def output_path(spec, stage):
+    kind, name = split(stage)
+    output_dir = spec.get('output_dir', 'results')
+    if kind == 'model':
+        return os.path.join(output_dir, 'models', name + '.pkl')
+    if kind == 'figure':
+        return os.path.join(output_dir, 'figures', entry(spec, stage)['output'])
+    return None
+
+
+def load_state(path = STATE_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state, path = STATE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent = 1, sort_keys = True)
+    os.replace(tmp, path)
+
+
+def stale_stages(spec, graph, sigs, state, force = False):
+    stale = []
+    for stage in graphlib.TopologicalSorter(graph).static_order():
+        path = output_path(spec, stage)
+        if force or state.get(stage) != sigs[stage] or (path and not os.path.exists(path)):
+            stale.append(stage)
+    return stale
+
+
+# optional RT outlier filter of a data source, e.g. {"min_rt": 150, "sd_cutoff": 2.5, "by": "subject"}
+def filter_options(source):
+    if 'filter' not in source:
+        return None
+    options = dict(min_rt = 150, sd_cutoff = 2.5, by = 'subject')
+    options.update(source['filter'])
+    return options
+
+
+def _save_pickle(obj, path):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with open(path, 'wb') as f:
+        pickle.dump(obj, f, protocol = pickle.HIGHEST_PROTOCOL)
+
+
+def _load_pickle(path):
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+
+# re-executes only the stages whose spec entry or inputs changed since the last run
+# (with force, every stage, refitting past the result cache and redrawing every figure);
+# backend overrides every model's backend, as if the spec entries named it, so models
+# last fitted with another backend are refitted
+def run(spec_path = SPEC_PATH, force = False, n_workers = None, state_path = STATE_PATH, backend = None):
+    spec = with_backend(load_spec(spec_path), backend)
+    graph = build_graph(spec)
+    sigs = signatures(spec, graph)
+    state = load_state(state_path)
+    stale = stale_stages(spec, graph, sigs, state, force)
+
+    frames = {}
+
+    def frame(name):
+        if name not in frames:
+            source = spec['data'][name]
+            frames[name] = preprocessing.load_clean(source['path'], source['kind'])
+            options = filter_options(source)
+            if options:
+                from rt_filter import filter_rt, print_report
+
+                with instrument.stage('rt_filter', rows_in = len(frames[name])) as stage:
+                    frames[name], report = filter_rt(frames[name], **options)
+                    stage['rows_out'] = len(frames[name])
+                print_report(report, **options)
+        return frames[name]
+
+    for stage in stale:
+        kind, name = split(stage)
+        if kind == 'data':
+            frame(name)
+            state[stage] = sigs[stage]
+            save_state(state, state_path)
+
+    # stale models on the same data source are fitted together in one pool
+    for data in spec['data']:
+        names = [split(stage)[1] for stage in stale
+                 if stage.startswith('model:') and entry(spec, stage)['data'] == data]
+        if not names:
+            continue
+        # a model refitted on more data starts from its last estimates
+        jobs = [warm_start(spec_job(name, spec['models'][name]), _load_pickle(output_path(spec, f'model:{name}')))
+                for name in names]
+        results = run_jobs(jobs, frame(data), n_workers, cache = not force)
+        print_results(results)
+        for name, result in zip(names, results):
+            stage = f'model:{name}'
+            _save_pickle(result, output_path(spec, stage))
+            state[stage] = sigs[stage]
+        save_state(state, state_path)
+
+    # every fitted model's anova and post-hoc tables, rewritten when a model changed;
+    # only the images of tables whose rows changed are drawn again
+    output_dir = spec.get('output_dir', 'results')
+    if spec['models'] and (any(stage.startswith('model:') for stage in stale)
+                           or not os.path.exists(os.path.join(output_dir, 'tables.csv'))):
+        from results_export import export
+
+        with instrument.stage('export_tables') as stage:
+            stage['rows_out'] = len(export(spec, output_dir, force = force))
+
+    # figures only need the persisted cell-means cubes, not the trial-level data,
+    # and are drawn in parallel
+    figures = {split(stage)[1]: entry(spec, stage) for stage in stale if stage.startswith('figure:')}
+    if figures:
+        from render import render_figures
+
+        out_dir = os.path.dirname(output_path(spec, 'figure:' + next(iter(figures))))
+        render_figures(figures, cube_loader(spec), out_dir, n_workers, force = force)
+        for name in figures:
+            state[f'figure:{name}'] = sigs[f'figure:{name}']
+        save_state(state, state_path)
+
+    return stale
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Run the stages of the analysis spec that changed.')
+    parser.add_argument('--spec', default = SPEC_PATH)
+    parser.add_argument('--force', action = 'store_true', help = 'rerun every stage')
+    parser.add_argument('--dry-run', action = 'store_true', help = 'only list the stages that would run')
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--backend', choices = ['lme4', 'native'], default = None,
+                        help = 'override the model backend of every spec model')
+    args = parser.parse_args()
+
+    if args.dry_run:
+        spec = with_backend(load_spec(args.spec), args.backend)
+        graph = build_graph(spec)
+        stale = stale_stages(spec, graph, signatures(spec, graph), load_state(), args.force)
+    else:
+        stale = run(args.spec, args.force, args.workers, backend = args.backend)
+    for stage in stale:
+        print(stage)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from design import coef_matrix, parse_coef, term_names
+
+
+def sig_stars(p):
+    return np.select([p < .001, p < .01, p < .05, p < .1], ['***', '**', '*', '.'], '')
+
+
+# Type III Wald chi-square test of every term from the fixed-effect estimates, the same
+# for both backends (R's anova() of a glmer fit has no p-values)
+def wald_anova(names, beta, vcov, terms, factors):
+    rows = []
+    for term in terms:
+        idx = [names.index(name) for name in term_names(term, factors)]
+        chisq = beta[idx] @ np.linalg.solve(vcov[np.ix_(idx, idx)], beta[idx])
+        rows.append((':'.join(term), len(idx), chisq, stats.chi2.sf(chisq, len(idx))))
+    table = pd.DataFrame(rows, columns = ['Term', 'NumDF', 'Chisq', 'P-val']).set_index('Term')
+    table['Sig'] = sig_stars(table['P-val'].to_numpy())
+    return table
+
+
+# vectorized p-value adjustment over one family of tests
+def p_adjust(p, method = 'bonf'):
+    p = np.asarray(p, dtype = float)
+    m = len(p)
+    if method in (None, 'none') or m == 0:
+        return p
+    if method in ('bonf', 'bonferroni'):
+        return np.minimum(p * m, 1)
+    order = np.argsort(p)
+    if method == 'holm':
+        adjusted = np.maximum.accumulate((m - np.arange(m)) * p[order])
+    elif method in ('fdr', 'BH'):
+        adjusted = np.minimum.accumulate((m / np.arange(m, 0, -1)) * p[order][::-1])[::-1]
+    else:
+        raise ValueError(f"Unknown p_adjust method '{method}'")
+    out = np.empty(m)
+    out[order] = np.minimum(adjusted, 1)
+    return out
+
+
+# fixed-effect estimates and their covariance from a fitted pymer4 model, in one R call;
+# native glmm.GLMM fits already hold them
+def export_estimates(model):
+    if hasattr(model, 'estimates'):
+        return model.estimates()
+    from rpy2 import robjects
+
+    vcov = robjects.r('function(m) as.matrix(vcov(m))')(model.model_obj)
+    names = list(model.coefs.index)
+    p = len(names)
+    return names, model.coefs['Estimate'].to_numpy(dtype = float), \
+        np.array(list(vcov), dtype = float).reshape(p, p, order = 'F')
+
+
+def model_factors(names, factors):
+    used = {factor for name in names[1:] for factor, _ in parse_coef(name, factors)}
+    return {factor: levels for factor, levels in factors.items() if factor in used}
+
+
+# emmeans-style marginal means (equal weights over the reference grid) and
+# pairwise contrasts for every marginal-variable set, from one beta/vcov export.
+# GLMM inference is asymptotic (DF = inf, z statistics), as emmeans does for glmer
+def batch_post_hoc(names, beta, vcov, factors, marginal_sets, p_adjust_method = 'bonf',
+                   ordered = True, alpha = 0.05):
+    factors = model_factors(names, factors)
+    grid = pd.DataFrame(list(itertools.product(*factors.values())), columns = list(factors))
+    L_grid = coef_matrix(grid, names, factors, ordered)
+
+    blocks = []
+    for marginal_vars in marginal_sets:
+        missing = [var for var in marginal_vars if var not in factors]
+        if missing:
+            raise ValueError(f"marginal_vars {missing} are not factors in the model")
+
+        # one row per marginal cell, averaging the grid rows that fall in it
+        # the first variable varies fastest, matching emmeans' cell and contrast order
+        reverse = list(marginal_vars)[::-1]
+        cells = pd.DataFrame(list(itertools.product(*(factors[v] for v in reverse))),
+                             columns = reverse)[list(marginal_vars)]
+        member = np.ones((len(cells), len(grid)), dtype = bool)
+        for var in marginal_vars:
+            member &= cells[var].to_numpy()[:, None] == grid[var].to_numpy()[None, :]
+        L_cells = (member / member.sum(axis = 1, keepdims = True)) @ L_grid
+
+        pairs = list(itertools.combinations(range(len(cells)), 2))
+        C = np.zeros((len(pairs), len(cells)))
+        for row, (i, j) in enumerate(pairs):
+            C[row, i], C[row, j] = 1, -1
+        blocks.append((marginal_vars, cells, pairs, L_cells, C @ L_cells))
+
+    # every estimate and contrast of every set in one pass
+    L = np.vstack([np.vstack([block[3], block[4]]) for block in blocks])
+    estimate = L @ beta
+    se = np.sqrt(np.einsum('ij,jk,ik->i', L, vcov, L))
+
+    results = []
+    start = 0
+    for marginal_vars, cells, pairs, L_cells, L_pairs in blocks:
+        n_cells, n_pairs = len(L_cells), len(L_pairs)
+        est, err = estimate[start:start + n_cells], se[start:start + n_cells]
+        c_est, c_err = estimate[start + n_cells:start + n_cells + n_pairs], se[start + n_cells:start + n_cells + n_pairs]
+        start += n_cells + n_pairs
+
+        z = stats.norm.ppf(1 - alpha / 2)
+        marginal_estimates = cells.assign(**{'Estimate': est, '2.5_ci': est - z * err,
+                                             '97.5_ci': est + z * err, 'SE': err, 'DF': np.inf})
+
+        labels = [' '.join(map(str, row)) for row in cells.itertuples(index = False)]
+        z_stat = c_est / c_err
+        p = p_adjust(2 * stats.norm.sf(np.abs(z_stat)), p_adjust_method)
+        # bonferroni-adjusted intervals, as emmeans' confint() reports them
+        z_c = stats.norm.ppf(1 - alpha / (2 * n_pairs)) if p_adjust_method in ('bonf', 'bonferroni') else z
+        comparisons = pd.DataFrame({'Contrast': [f'{labels[i]} - {labels[j]}' for i, j in pairs],
+                                    'Estimate': c_est, '2.5_ci': c_est - z_c * c_err,
+                                    '97.5_ci': c_est + z_c * c_err, 'SE': c_err, 'DF': np.inf,
+                                    'Z-stat': z_stat, 'P-val': p})
+        comparisons['Sig'] = sig_stars(comparisons['P-val'].to_numpy())
+        # unrounded: inverse_gaussian estimates on the 1/mu^2 scale are ~1e-6
+        results.append((list(marginal_vars), marginal_estimates, comparisons))
+    return results
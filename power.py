@@ -0,0 +1,235 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+from scipy import special
+
+from design import design_matrix, parse_formula, set_levels
+from model_runner import model_class
+
+ALPHA = 0.05
+# simulations per task; each worker fits a batch before reporting back
+BATCH = 10
+# stop once every effect's 95% interval on power is within +/- PRECISION...
+PRECISION = 0.05
+# ...but never before MIN_SIMS simulations, nor after MAX_SIMS
+MIN_SIMS = 50
+MAX_SIMS = 1000
+
+
+# the generating parameters from a fitted result: fixed effects, random-intercept SD
+# (tau) and dispersion (phi, ignored for binomial); both backends store these in 'start'
+def simulation_parameters(result):
+    start = result.get('start')
+    if start is None or 'tau' not in start:
+        raise ValueError(f"The stored fit of '{result['name']}' has no variance estimates; refit it first")
+    return {'fixef': np.asarray(start['fixef'], dtype = float), 'tau': float(start['tau']),
+            'phi': float(start['phi'])}
+
+
+# n_subjects x n_trials rows, the trials of each subject spread evenly over the cells
+# of the factors in the formula, as in synthetic.generate()
+def design_frame(job, n_subjects, n_trials):
+    _, terms, group = parse_formula(job['formula'])
+    used = [factor for factor in job['factors'] if any(factor in term for term in terms)]
+    cells = pd.DataFrame(list(itertools.product(*(job['factors'][factor] for factor in used))), columns = used)
+    rows = np.tile(np.arange(n_trials) % len(cells), n_subjects)
+    data = cells.iloc[rows].reset_index(drop = True)
+    data[group] = np.repeat(np.arange(1, n_subjects + 1), n_trials)
+    return set_levels(data, job['factors'])
+
+
+# draws the response given the linear predictor; numpy's Wald scale is lambda = 1/phi
+def draw_response(family, eta, phi, rng):
+    if family == 'binomial':
+        return (rng.random(len(eta)) < special.expit(eta)).astype(int)
+    if family == 'inverse_gaussian':
+        return rng.wald(1 / np.sqrt(eta), 1 / phi)
+    if family == 'gaussian':
+        return rng.normal(eta, np.sqrt(phi))
+    raise ValueError(f"Cannot simulate family '{family}'")
+
+
+# subject intercepts on the link scale; for inverse_gaussian a subject whose linear
+# predictor would leave the valid range (eta > 0) is drawn again
+def draw_intercepts(family, eta, subjects, n_subjects, tau, rng):
+    b = rng.normal(0, tau, n_subjects)
+    if family != 'inverse_gaussian':
+        return b
+    for _ in range(100):
+        invalid = np.unique(subjects[eta + b[subjects] <= 0])
+        if len(invalid) == 0:
+            return b
+        b[invalid] = rng.normal(0, tau, len(invalid))
+    raise ValueError("Cannot draw subject intercepts that keep the inverse_gaussian mean positive")
+
+
+# runs in a worker: simulates and fits each of `sims` datasets; returns one row per
+# simulation with every term's Wald p-value, or the error if the fit failed
+def simulate_batch(job, params, n_subjects, n_trials, sims, seed = 0):
+    from posthoc import export_estimates, wald_anova
+
+    data = design_frame(job, n_subjects, n_trials)
+    response, terms, group = parse_formula(job['formula'])
+    # only the factors the formula uses are simulated; pymer4 looks up every factor it is given
+    factors = {factor: levels for factor, levels in job['factors'].items() if factor in data}
+    names, X = design_matrix(data, job['formula'], factors, job['ordered'])
+    if len(names) != len(params['fixef']):
+        raise ValueError(f"{job['name']}: {len(params['fixef'])} estimates for {len(names)} coefficients; refit the model")
+    eta = X @ params['fixef']
+    subjects = data[group].to_numpy() - 1
+
+    rows = []
+    for sim in sims:
+        rng = np.random.default_rng([seed, sim])
+        b = draw_intercepts(job['family'], eta, subjects, n_subjects, params['tau'], rng)
+        data[response] = draw_response(job['family'], eta + b[subjects], params['phi'], rng)
+        row = {'sim': sim}
+        started = time.perf_counter()
+        try:
+            model = model_class(job['backend'])(job['formula'], data = data, family = job['family'])
+            model.fit(factors = factors, ordered = job['ordered'], summarize = False)
+            table = wald_anova(*export_estimates(model), terms, factors)
+            row.update(table['P-val'].to_dict())
+            row['warnings'] = len(model.warnings)
+        except Exception as e:
+            row['error'] = repr(e)
+        row['seconds'] = time.perf_counter() - started
+        rows.append(row)
+    if all('error' in row for row in rows):
+        raise RuntimeError(f"{job['name']}: every fit of simulations {sims[0]}-{sims[-1]} failed, "
+                           f"e.g. {rows[0]['error']}")
+    return rows
+
+
+# Wilson score interval for k detections in n simulations
+def wilson(k, n, z = 1.96):
+    p = k / n
+    centre = (p + z ** 2 / (2 * n)) / (1 + z ** 2 / n)
+    half = z * np.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2)) / (1 + z ** 2 / n)
+    return max(centre - half, 0.0), min(centre + half, 1.0)
+
+
+# power of every term so far, from the successful fits
+def power_table(rows, alpha = ALPHA):
+    fits = pd.DataFrame(rows)
+    failed = int(fits['error'].notna().sum()) if 'error' in fits else 0
+    if 'error' in fits:
+        fits = fits[fits['error'].isna()]
+    terms = [column for column in fits.columns if column not in ('sim', 'warnings', 'error', 'seconds')]
+    out = []
+    for term in terms:
+        n = len(fits)
+        k = int((fits[term] < alpha).sum())
+        low, high = wilson(k, n) if n else (0.0, 1.0)
+        out.append({'term': term, 'n_sims': n, 'detected': k, 'power': k / n if n else np.nan,
+                    'ci_low': low, 'ci_high': high, 'failed': failed,
+                    'with_warnings': int((fits['warnings'] > 0).sum()) if n else 0})
+    return pd.DataFrame(out)
+
+
+# simulates one model at one sample size on the pool, batch by batch; prints every
+# term's running power as batches come back and stops once every interval is within
+# +/- precision
+def run_setting(pool, n_workers, job, params, n_subjects, n_trials, seed = 0, alpha = ALPHA,
+                precision = PRECISION, min_sims = MIN_SIMS, max_sims = MAX_SIMS, batch = BATCH):
+    rows = []
+    batches = (range(start, min(start + batch, max_sims)) for start in range(0, max_sims, batch))
+    futures = set()
+    done = False
+    started = time.perf_counter()
+    try:
+        while not done:
+            # keep every worker busy, plus one batch queued behind each
+            for sims in itertools.islice(batches, max(0, 2 * n_workers - len(futures))):
+                futures.add(pool.submit(simulate_batch, job, params, n_subjects, n_trials, list(sims), seed))
+            if not futures:
+                break
+            finished, futures = wait(futures, return_when = FIRST_COMPLETED)
+            for future in finished:
+                rows.extend(future.result())
+            table = power_table(rows, alpha)
+            if table.empty:
+                errors = [row['error'] for row in rows if 'error' in row]
+                raise RuntimeError(f"{job['name']}: all {len(rows)} simulated fits failed, e.g. {errors[0]}")
+            widest = ((table['ci_high'] - table['ci_low']) / 2).max()
+            n = int(table['n_sims'].iloc[0])
+            print(f"{job['name']} {n_subjects} subjects x {n_trials} trials: {n} sims, "
+                  f"widest interval +/- {widest:.3f}, {time.perf_counter() - started:.0f} s", flush = True)
+            print(table[['term', 'power', 'ci_low', 'ci_high']].round(3).to_string(index = False), flush = True)
+            done = n >= min_sims and widest <= precision
+    finally:
+        # batches already running cannot be cancelled; wait for them, so the next
+        # setting starts on idle workers (their simulations are not counted)
+        for future in futures:
+            future.cancel()
+        wait(futures)
+    table = power_table(rows, alpha)
+    table.insert(0, 'trials', n_trials)
+    table.insert(0, 'subjects', n_subjects)
+    table.insert(0, 'model', job['name'])
+    return table
+
+
+# power of the chosen spec models at every subjects x trials combination, simulated
+# from their last pipeline fit (results/models/<name>.pkl)
+def run(spec_path = 'analysis_spec.json', models = None, subjects = (20,), trials = (320,), n_workers = None,
+        backend = None, alpha = ALPHA, precision = PRECISION, max_sims = MAX_SIMS, seed = 0,
+        output = os.path.join('results', 'power.csv')):
+    import pickle
+
+    from pipeline import load_spec, output_path, spec_job
+
+    spec = load_spec(spec_path)
+    n_workers = max(1, n_workers or os.cpu_count() or 1)
+    tables = []
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers = n_workers, mp_context = context) as pool:
+        for name in models or spec['models']:
+            job = spec_job(name, spec['models'][name])
+            if backend is not None:
+                job['backend'] = backend
+            path = output_path(spec, f'model:{name}')
+            if not os.path.exists(path):
+                raise ValueError(f"Model '{name}' has not been fitted yet ({path}); run the pipeline first")
+            with open(path, 'rb') as f:
+                params = simulation_parameters(pickle.load(f))
+            for n_subjects, n_trials in itertools.product(subjects, trials):
+                tables.append(run_setting(pool, n_workers, job, params, n_subjects, n_trials, seed, alpha,
+                                          precision, max_sims = max_sims))
+                print(tables[-1].round(3).to_string(index = False))
+
+    table = pd.concat(tables, ignore_index = True)
+    if output:
+        os.makedirs(os.path.dirname(output) or '.', exist_ok = True)
+        table.to_csv(output, index = False)
+        print(f"{len(table)} rows -> {output}")
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Simulation-based power of the spec models.')
+    parser.add_argument('--spec', default = 'analysis_spec.json')
+    parser.add_argument('--models', nargs = '+', help = 'spec models (default: all)')
+    parser.add_argument('--subjects', type = int, nargs = '+', default = [20])
+    parser.add_argument('--trials', type = int, nargs = '+', default = [320], help = 'trials per subject')
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--backend', choices = ['lme4', 'native'], default = None)
+    parser.add_argument('--alpha', type = float, default = ALPHA)
+    parser.add_argument('--precision', type = float, default = PRECISION,
+                        help = 'stop once every 95%% interval on power is within +/- this')
+    parser.add_argument('--max-sims', type = int, default = MAX_SIMS)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--output', default = os.path.join('results', 'power.csv'))
+    args = parser.parse_args()
+    run(args.spec, args.models, args.subjects, args.trials, args.workers, args.backend, args.alpha,
+        args.precision, args.max_sims, args.seed, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+import glob
+import hashlib
+import os
+
+import pandas as pd
+
+import instrument
+from design import set_levels
+from model_runner import FACTORS
+from row_index import sort_design
+
+# columns needed from each export
+RT_COLUMNS = ['Subject', 'Seen', 'Attention', 'Region', 'Task', 'Target.RT', 'TargetPresence']
+RAW_COLUMNS = ['Subject', 'Awareness', 'Attention', 'Region', 'Task', 'Target.ACC', 'TargetPresence']
+# columns read from the export for each kind of source (raw_rt: RT_COLUMNS of raw_data_all.csv)
+READ_COLUMNS = {'rt': RT_COLUMNS, 'raw': RAW_COLUMNS,
+                'raw_rt': ['Subject', 'Awareness', 'Attention', 'Region', 'Task', 'Target.RT', 'TargetPresence']}
+# export rows parsed and cleaned at a time by load_clean()
+CHUNK_ROWS = 100_000
+
+awareness_mapping = {'1': 'Seen', '0': 'Unseen'}
+region_mapping = {'F': 'FEF', 'V': 'Vertex'}
+
+# cleaned frames are cached here, one file per source hash
+CACHE_DIR = '.cache'
+# bump when the cleaning steps change so old caches are not reused
+CACHE_VERSION = 4
+
+
+# sessions added to a data file by ingest.py are kept as files of their own in
+# <file>.sessions/, so the export itself is never rewritten
+def sessions_dir(path):
+    return os.path.splitext(path)[0] + '.sessions'
+
+
+# a source path may be a glob of per-subject/per-session files, e.g. 'sessions/*.csv',
+# read in name order; a single file is read followed by its ingested sessions
+def source_paths(path):
+    if not glob.has_magic(path):
+        return [path] + sorted(glob.glob(os.path.join(glob.escape(sessions_dir(path)), '*.csv')))
+    paths = sorted(glob.glob(path))
+    if not paths:
+        raise FileNotFoundError(f"No files match '{path}'")
+    return paths
+
+
+# hash the raw bytes of the source file(s); cheaper than parsing them
+def file_hash(path, block_size=1 << 20):
+    h = hashlib.sha256()
+    paths = source_paths(path)
+    for file in paths:
+        if len(paths) > 1:
+            # a renamed or added file changes the glob's hash
+            h.update(os.path.basename(file).encode() + b'\0')
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                h.update(block)
+    return h.hexdigest()
+
+
+# text columns are parsed straight to categoricals, so no per-row strings are held;
+# Seen/Awareness are 0/1 codes and stay text categories so the mapping applies;
+# usecols skips the other columns while parsing, chunksize returns an iterator of frames
+def read_export(path, usecols = None, chunksize = None):
+    text = ['Seen', 'Awareness', 'Attention', 'Region', 'Task', 'TargetPresence']
+    return pd.read_csv(path, sep = ';', dtype = dict.fromkeys(text, 'category'), usecols = usecols,
+                       chunksize = chunksize)
+
+
+# compact schema for cleaned trials: factors are categoricals with the level order
+# of FACTORS (as passed to fit()), Subject is categorical, Seen/Target.ACC are int8
+# and Target.RT is float32; a level missing from FACTORS is an error, not a NaN.
+# Rows come back sorted by the design factors (row_index.sort_design)
+def compact(df):
+    for column, levels in FACTORS.items():
+        if column in df:
+            unknown = set(df[column].unique()) - set(levels)
+            if unknown:
+                raise ValueError(f"Unexpected '{column}' levels {sorted(map(str, unknown))}; expected {levels}")
+    dtypes = {'Subject': 'category', 'TargetPresence': 'category'}
+    dtypes.update({column: 'int8' for column in ('Seen', 'Target.ACC') if column in df})
+    if 'Target.RT' in df:
+        dtypes['Target.RT'] = 'float32'
+    df = df.astype(dtypes)
+    # only the levels present, so the categories do not depend on how the export was read
+    df = df.assign(**{column: df[column].cat.remove_unused_categories() for column in ('Subject', 'TargetPresence')
+                      if column in df})
+    return sort_design(set_levels(df, FACTORS))
+
+
+# rt_filtered.csv: 'Seen' is the 0/1 column, 'Awareness' is derived from it
+def clean_rt(raw_data):
+    # select only Present trials first, so later steps copy fewer rows
+    df = raw_data.loc[raw_data['TargetPresence'] == 'Present', RT_COLUMNS].copy()
+
+    df['Awareness'] = df['Seen'].map(awareness_mapping)
+    df['Region'] = df['Region'].map(lambda code: region_mapping.get(code, code))
+
+    # remove missing values
+    return compact(df.dropna()).reset_index(drop = True)
+
+
+# raw_data_all.csv: 'Awareness' is the 0/1 column; copy it to 'Seen' (DV) and map 'Awareness' (IV)
+def clean_raw(raw_data):
+    df = raw_data.loc[raw_data['TargetPresence'] == 'Present', RAW_COLUMNS].copy()
+
+    df['Seen'] = df['Awareness']
+    df['Awareness'] = df['Seen'].map(awareness_mapping)
+    df['Region'] = df['Region'].map(lambda code: region_mapping.get(code, code))
+
+    return compact(df.dropna()).reset_index(drop = True)
+
+
+# raw_data_all.csv read as rt data (for in-pipeline RT filtering): 'Awareness' is the 0/1 column
+def clean_raw_rt(raw_data):
+    raw_data = raw_data.drop(columns = ['Seen'], errors = 'ignore')
+    return clean_rt(raw_data.rename(columns = {'Awareness': 'Seen'}))
+
+
+cleaners = {'rt': clean_rt, 'raw': clean_raw, 'raw_rt': clean_raw_rt}
+
+
+# reads only the kind's columns of each file, chunk_rows rows at a time, and cleans
+# (Present trials, recoding, dropna, compact) every chunk before parsing the next, so
+# only one chunk of the export is ever held as parsed text; the result is the same as
+# cleaning the whole export at once. Returns the cleaned frame and the rows read
+def stream_clean(path, kind, chunk_rows = CHUNK_ROWS):
+    clean = cleaners[kind]
+    parts = []
+    n_rows = 0
+    for file in source_paths(path):
+        for chunk in read_export(file, usecols = READ_COLUMNS[kind], chunksize = chunk_rows):
+            n_rows += len(chunk)
+            parts.append(clean(chunk))
+    # chunks' Subject/TargetPresence categories differ; compact() sets them again
+    return compact(pd.concat(parts, ignore_index = True)).reset_index(drop = True), n_rows
+
+
+def cache_path(path, kind, cache_dir = CACHE_DIR):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if glob.has_magic(path):
+        # named after the directory above the first wildcard, e.g. sessions/*.csv and
+        # sessions/*/data.csv -> sessions
+        parts = os.path.abspath(path).split(os.sep)
+        fixed = next(i for i, part in enumerate(parts) if glob.has_magic(part))
+        stem = parts[fixed - 1] or 'glob'
+    key = file_hash(path)[:16]
+    return os.path.join(cache_dir, f'{stem}-{kind}-v{CACHE_VERSION}-{key}.feather')
+
+
+def read_cache(path):
+    try:
+        from pyarrow import feather
+    except ImportError:
+        return None
+    if not os.path.exists(path):
+        return None
+    # the gain is skipping CSV parsing and cleaning: the columns come back already typed
+    # (categoricals, int8, float32), though to_pandas() still copies them into pandas
+    return feather.read_table(path).to_pandas()
+
+
+def write_cache(df, path):
+    try:
+        from pyarrow import feather
+    except ImportError:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    # write to a temp file first so a crashed run never leaves a half-written cache
+    tmp = path + '.tmp'
+    feather.write_feather(df, tmp, compression = 'uncompressed')
+    os.replace(tmp, path)
+
+
+def load_clean(path, kind, cache = True, cache_dir = CACHE_DIR):
+    if cache:
+        cached = cache_path(path, kind, cache_dir)
+        with instrument.stage('read_cache') as stage:
+            df = read_cache(cached)
+            stage['rows_out'] = None if df is None else len(df)
+        if df is not None:
+            return df
+
+    with instrument.stage('read_clean') as stage:
+        df, stage['rows_in'] = stream_clean(path, kind)
+        stage['rows_out'] = len(df)
+    if cache:
+        write_cache(df, cached)
+    return df
+
+
+# already filtered rt data (filter: >150ms, +/- 2.5 SD)
+def load_rt_data(path = 'rt_filtered.csv', **kwargs):
+    return load_clean(path, 'rt', **kwargs)
+
+
+def load_raw_data(path = 'raw_data_all.csv', **kwargs):
+    return load_clean(path, 'raw', **kwargs)
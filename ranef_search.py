@@ -0,0 +1,243 @@
+import argparse
+import multiprocessing
+import os
+import re
+import time
+from multiprocessing.connection import wait
+
+import pandas as pd
+from scipy import stats
+
+from design import parse_formula, set_levels
+import row_index
+from model_runner import model_class, subset_frame
+
+# seconds a single candidate may run before it is stopped
+BUDGET = 600
+
+
+# '(1+Attention|Subject)' -> ('Subject', frozenset({'Attention'}))
+def parse_ranef(structure):
+    match = re.fullmatch(r'\(\s*(.+?)\s*\|\s*([\w.]+)\s*\)', structure.strip())
+    if not match:
+        raise ValueError(f"Cannot parse random-effects structure '{structure}'; expected e.g. '(1+Attention|Subject)'")
+    slopes = {term.strip() for term in match.group(1).split('+')} - {'1', ''}
+    return match.group(2), frozenset(slopes)
+
+
+# the formula's fixed part with a different random-effects part
+def with_ranef(formula, structure):
+    response, rhs = [part.strip() for part in formula.split('~', 1)]
+    fixed = [part.strip() for part in re.split(r'\+(?![^(]*\))', rhs) if not part.strip().startswith('(')]
+    return f"{response} ~ {' + '.join(fixed)} + {structure}"
+
+
+# (1|group) plus one correlated random slope per main effect of the model
+def default_structures(job):
+    _, terms, group = parse_formula(job['formula'])
+    slopes = [term[0] for term in terms if len(term) == 1]
+    return [f'(1|{group})'] + [f'(1+{slope}|{group})' for slope in slopes]
+
+
+# b is nested in a: same grouping, and a adds random slopes to b's
+def nests(a, b):
+    group_a, slopes_a = parse_ranef(a)
+    group_b, slopes_b = parse_ranef(b)
+    return group_a == group_b and slopes_b < slopes_a
+
+
+def classify(warnings):
+    text = ' '.join(warnings).lower()
+    if 'singular' in text:
+        return 'singular'
+    if 'converge' in text:
+        return 'not converged'
+    return 'ok'
+
+
+# runs in its own process, so a fit past its budget can be stopped
+def fit_candidate(job, data, conn):
+    started = time.perf_counter()
+    try:
+        model = model_class(job['backend'])(job['formula'], data = set_levels(data, job['factors']),
+                                            family = job['family'])
+        model.fit(factors = job['factors'], ordered = job['ordered'], summarize = False)
+        warnings = [str(warning) for warning in model.warnings]
+        result = {'status': classify(warnings), 'logLik': float(model.logLike),
+                  'AIC': float(model.AIC), 'BIC': float(model.BIC), 'warnings': warnings}
+    except Exception as e:
+        result = {'status': 'error', 'warnings': [repr(e)]}
+    result['seconds'] = time.perf_counter() - started
+    conn.send(result)
+    conn.close()
+
+
+# fits every candidate ({'model', 'structure', 'job', 'data'}), at most n_workers at a
+# time and simplest first; once a structure ends singular, unconverged, failed or past
+# its budget, the richer structures of the same model that nest it are stopped or skipped
+def search(candidates, n_workers = None, budget = BUDGET):
+    n_workers = max(1, n_workers or os.cpu_count() or 1)
+    context = multiprocessing.get_context('spawn')
+    pending = sorted(range(len(candidates)), key = lambda i: len(parse_ranef(candidates[i]['structure'])[1]))
+    running = {}
+    results = {}
+
+    def stop_nested(i):
+        reason = f"nests {candidates[i]['structure']} ({results[i]['status']})"
+        for j, candidate in enumerate(candidates):
+            if candidate['model'] != candidates[i]['model'] or not nests(candidate['structure'], candidates[i]['structure']):
+                continue
+            if j in pending:
+                pending.remove(j)
+                results[j] = {'status': 'skipped', 'warnings': [reason], 'seconds': 0.0}
+            for conn, (k, process, started) in list(running.items()):
+                if k == j:
+                    process.terminate()
+                    process.join()
+                    del running[conn]
+                    results[j] = {'status': 'stopped', 'warnings': [reason],
+                                  'seconds': time.monotonic() - started}
+
+    while pending or running:
+        while pending and len(running) < n_workers:
+            i = pending.pop(0)
+            receiver, sender = context.Pipe(duplex = False)
+            process = context.Process(target = fit_candidate, daemon = True,
+                                      args = (candidates[i]['job'], candidates[i]['data'], sender))
+            process.start()
+            sender.close()
+            running[receiver] = (i, process, time.monotonic())
+
+        first_deadline = min(started for _, _, started in running.values()) + budget
+        for conn in wait(list(running), timeout = max(0.0, first_deadline - time.monotonic())):
+            if conn not in running:
+                # stopped while handling another finished fit
+                continue
+            i, process, started = running.pop(conn)
+            try:
+                results[i] = conn.recv()
+            except EOFError:
+                results[i] = {'status': 'error', 'warnings': [f'worker exited with code {process.exitcode}'],
+                              'seconds': time.monotonic() - started}
+            process.join()
+            if results[i]['status'] != 'ok':
+                stop_nested(i)
+
+        for conn, (i, process, started) in list(running.items()):
+            if conn in running and time.monotonic() - started >= budget:
+                process.terminate()
+                process.join()
+                del running[conn]
+                results[i] = {'status': 'timeout', 'warnings': [f'stopped after {budget} s'], 'seconds': budget}
+                stop_nested(i)
+
+    return [dict(model = candidate['model'], structure = candidate['structure'], **results[i])
+            for i, candidate in enumerate(candidates)]
+
+
+# chi-square(0) is a point mass at zero
+def mixture_p(chisq, df):
+    lower = stats.chi2.sf(chisq, df - 1) if df > 1 else float(chisq == 0)
+    return 0.5 * (stats.chi2.sf(chisq, df) + lower)
+
+
+# AIC/BIC differences to the model's best converged structure, and a likelihood-ratio
+# test of each converged structure against the richest converged one nested in it.
+# A variance on the boundary makes the plain chi-square p conservative; p_mixture
+# is the usual 50:50 chi-square(df) / chi-square(df - 1) mixture for an added slope
+def compare(results):
+    table = pd.DataFrame(results)
+    for column in ('logLik', 'AIC', 'BIC'):
+        if column not in table:
+            table[column] = float('nan')
+    table['n_params'] = (table['AIC'] + 2 * table['logLik']) / 2
+    ok = table['status'] == 'ok'
+    for criterion in ('AIC', 'BIC'):
+        best = table[ok].groupby('model')[criterion].min()
+        table[f'delta_{criterion}'] = table[criterion] - table['model'].map(best)
+
+    for i in table.index[ok]:
+        row = table.loc[i]
+        nested = table[ok & (table['model'] == row['model'])
+                       & table['structure'].map(lambda structure: nests(row['structure'], structure))]
+        if nested.empty:
+            continue
+        base = nested.loc[nested['n_params'].idxmax()]
+        chisq = max(2 * (row['logLik'] - base['logLik']), 0.0)
+        df = int(round(row['n_params'] - base['n_params']))
+        table.loc[i, 'vs'] = base['structure']
+        table.loc[i, 'Chisq'] = chisq
+        table.loc[i, 'Df'] = df
+        table.loc[i, 'P-val'] = stats.chi2.sf(chisq, df)
+        table.loc[i, 'p_mixture'] = mixture_p(chisq, df)
+    table['warnings'] = table['warnings'].map('; '.join)
+    return table
+
+
+# candidates for the chosen spec models (all of them by default) on their data sources
+def spec_candidates(spec, models = None, structures = None, backend = None):
+    from pipeline import filter_options, spec_job
+    from preprocessing import load_clean
+
+    frames = {}
+    candidates = []
+    for name in models or spec['models']:
+        job = spec_job(name, spec['models'][name])
+        if backend is not None:
+            job['backend'] = backend
+        source = spec['models'][name]['data']
+        if source not in frames:
+            df = load_clean(spec['data'][source]['path'], spec['data'][source]['kind'])
+            options = filter_options(spec['data'][source])
+            if options:
+                from rt_filter import filter_rt
+
+                df, _ = filter_rt(df, **options)
+            frames[source] = df, row_index.build(df)
+        df, index = frames[source]
+        data = subset_frame(df, job['subset'], index)
+        for structure in structures or default_structures(job):
+            if job['backend'] == 'native' and parse_ranef(structure)[1]:
+                raise ValueError(f"The native backend fits random intercepts only; use lme4 for {structure}")
+            candidates.append({'model': name, 'structure': structure,
+                               'job': dict(job, formula = with_ranef(job['formula'], structure)), 'data': data})
+    return candidates
+
+
+def run(spec_path = 'analysis_spec.json', models = None, structures = None, n_workers = None,
+        backend = None, budget = BUDGET, output = os.path.join('results', 'ranef_search.csv')):
+    from pipeline import load_spec
+
+    candidates = spec_candidates(load_spec(spec_path), models, structures, backend)
+    table = compare(search(candidates, n_workers, budget))
+    columns = ['structure', 'status', 'n_params', 'logLik', 'AIC', 'delta_AIC', 'BIC', 'delta_BIC',
+               'vs', 'Chisq', 'Df', 'P-val', 'p_mixture', 'seconds']
+    for model, group in table.groupby('model', sort = False):
+        print(f"## model: {model}")
+        print(group.reindex(columns = columns).to_string(index = False))
+        for _, row in group[group['status'] != 'ok'].iterrows():
+            print(f"{row['structure']}: {row['warnings']}")
+    if output:
+        os.makedirs(os.path.dirname(output) or '.', exist_ok = True)
+        table.to_csv(output, index = False)
+        print(f"{len(table)} candidates -> {output}")
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Compare random-effects structures of the spec models.')
+    parser.add_argument('--spec', default = 'analysis_spec.json')
+    parser.add_argument('--models', nargs = '+', help = 'spec models to search (default: all)')
+    parser.add_argument('--structures', nargs = '+',
+                        help = "candidates such as '(1|Subject)' '(1+Attention|Subject)' "
+                               "(default: the intercept plus one slope per main effect)")
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--backend', choices = ['lme4', 'native'], default = None)
+    parser.add_argument('--budget', type = float, default = BUDGET, help = 'seconds per candidate')
+    parser.add_argument('--output', default = os.path.join('results', 'ranef_search.csv'))
+    args = parser.parse_args()
+    run(args.spec, args.models, args.structures, args.workers, args.backend, args.budget, args.output)
+
+
+if __name__ == '__main__':
+    main()
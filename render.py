@@ -0,0 +1,111 @@
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import instrument
+from aggregate import rollup, subset_cube
+
+# per-directory record of the spec + data hash each PNG was drawn from
+MANIFEST = '.figures.json'
+
+
+def _use_agg():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _draw(fig, data, path):
+    from figures import draw_figure
+
+    draw_figure(fig, data, path)
+    return path
+
+
+# subject-level means for one figure, rolled up from the cell-means cube
+def figure_data(fig, cube):
+    cube = subset_cube(cube, fig.get('subset', {}))
+    return rollup(cube, fig['groupby'], fig['measure'])
+
+
+def figure_key(fig, data):
+    h = hashlib.sha256(json.dumps(fig, sort_keys = True).encode())
+    h.update(pd.util.hash_pandas_object(data, index = False).values.tobytes())
+    return h.hexdigest()
+
+
+def load_manifest(out_dir, name = MANIFEST):
+    try:
+        with open(os.path.join(out_dir, name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest, out_dir, name = MANIFEST):
+    path = os.path.join(out_dir, name)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent = 1, sort_keys = True)
+    os.replace(path + '.tmp', path)
+
+
+# draws every figure whose spec or plotted data changed, across a process pool;
+# cube_for(fig) returns the cell-means cube the figure is rolled up from;
+# the plotting libraries are only imported when something has to be drawn
+def render_figures(figures, cube_for, out_dir = '.', n_workers = None, force = False):
+    os.makedirs(out_dir, exist_ok = True)
+    manifest = load_manifest(out_dir)
+
+    todo = []
+    with instrument.stage('figure_data') as stage:
+        for name, fig in figures.items():
+            data = figure_data(fig, cube_for(fig))
+            key = figure_key(fig, data)
+            path = os.path.join(out_dir, fig['output'])
+            if force or manifest.get(fig['output']) != key or not os.path.exists(path):
+                todo.append((name, fig, data, path, key))
+        stage['figures'] = len(figures)
+        stage['stale'] = len(todo)
+    if not todo:
+        return []
+
+    # significance labels from sign-flip tests on the subject means, unless the
+    # spec gives them by hand; the test table is saved next to the figure
+    from stats_tests import annotations, figure_tests
+
+    with instrument.stage('tests') as stage:
+        for i, (name, fig, data, path, key) in enumerate(todo):
+            if fig.get('pairs') and 'annotations' not in fig:
+                results = figure_tests(fig, cube_for(fig))
+                results.to_csv(os.path.splitext(path)[0] + '_tests.csv', index = False)
+                todo[i] = (name, dict(fig, annotations = annotations(results)), data, path, key)
+        stage['figures'] = len(todo)
+
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_workers = max(1, min(n_workers, len(todo)))
+
+    with instrument.stage('draw') as stage:
+        stage['figures'] = len(todo)
+        # the manifest is saved even if a figure fails, so finished figures are not redrawn
+        try:
+            if n_workers == 1:
+                _use_agg()
+                for name, fig, data, path, key in todo:
+                    _draw(fig, data, path)
+                    manifest[fig['output']] = key
+            else:
+                context = multiprocessing.get_context('spawn')
+                with ProcessPoolExecutor(max_workers = n_workers, mp_context = context,
+                                         initializer = _use_agg) as pool:
+                    futures = [(pool.submit(_draw, fig, data, path), fig, key)
+                               for name, fig, data, path, key in todo]
+                    for future, fig, key in futures:
+                        future.result()
+                        manifest[fig['output']] = key
+        finally:
+            save_manifest(manifest, out_dir)
+    return [name for name, *_ in todo]
@@ -0,0 +1,75 @@
+import hashlib
+import json
+import os
+import pickle
+
+import pandas as pd
+
+CACHE_DIR = os.path.join('.cache', 'models')
+# total size kept on disk; least recently used results are evicted first
+MAX_BYTES = 512 * 1024 ** 2
+
+# job fields that change the fitted results; name and subset only matter through the rows
+KEY_FIELDS = ('formula', 'family', 'factors', 'ordered', 'conf_int', 'post_hoc', 'p_adjust',
+              'post_hoc_engine', 'backend')
+# bump when what a fit stores changes, so older cached results are not reused
+RESULT_VERSION = 2
+
+
+def data_fingerprint(data):
+    h = hashlib.sha256()
+    h.update(json.dumps(list(map(str, data.columns))).encode())
+    h.update(pd.util.hash_pandas_object(data, index = False).values.tobytes())
+    return h.hexdigest()
+
+
+def result_key(job, data):
+    spec = {k: job[k] for k in KEY_FIELDS}
+    spec['version'] = RESULT_VERSION
+    if job['conf_int'] == 'boot':
+        spec.update(n_boot = job['n_boot'], seed = job['seed'])
+    h = hashlib.sha256(json.dumps(spec, sort_keys = True).encode())
+    h.update(data_fingerprint(data).encode())
+    return h.hexdigest()
+
+
+def _path(key, cache_dir):
+    return os.path.join(cache_dir, key + '.pkl')
+
+
+# returns the stored coefs/anova/post_hoc result, or None on a miss
+def get(key, cache_dir = CACHE_DIR):
+    path = _path(key, cache_dir)
+    try:
+        with open(path, 'rb') as f:
+            result = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    # mark as recently used for eviction
+    os.utime(path)
+    return result
+
+
+def put(key, result, cache_dir = CACHE_DIR, max_bytes = MAX_BYTES):
+    os.makedirs(cache_dir, exist_ok = True)
+    path = _path(key, cache_dir)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(result, f, protocol = pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+    evict(cache_dir, max_bytes)
+
+
+def evict(cache_dir = CACHE_DIR, max_bytes = MAX_BYTES):
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.pkl'):
+            stat = os.stat(os.path.join(cache_dir, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(os.path.join(cache_dir, name))
+        total -= size
@@ -0,0 +1,197 @@
+import argparse
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+# every coefficient, anova() and post-hoc table of a run, as one long table: one row per
+# coefficient, anova term, marginal estimate or contrast, with the model it came from; downstream reporting reads
+# it back with load_tables() instead of parsing the printed output
+TABLES = 'tables'
+# columns identifying each row; the statistics' columns follow, as the tables name them
+META = ['model', 'formula', 'family', 'backend', 'subset', 'p_adjust', 'table', 'term', 'level', 'contrast']
+# the identifying columns shown in each kind of table image
+IMAGE_COLUMNS = {'coefs': ['term'], 'anova': ['term'], 'estimates': ['term', 'level'], 'contrasts': ['term', 'contrast']}
+# record of the rows each table image was drawn from, next to the images
+MANIFEST = '.tables.json'
+# table image layout, in inches: per character of a column's widest cell (8 pt text),
+# per row, and above the table for the title
+CHAR_WIDTH = 0.075
+ROW_HEIGHT = 0.22
+TITLE_HEIGHT = 0.3
+
+
+def result_rows(job, result):
+    meta = {'model': result['name'], 'formula': job['formula'], 'family': job['family'],
+            'backend': job['backend'], 'subset': json.dumps(job['subset'], sort_keys = True),
+            'p_adjust': job['p_adjust']}
+    coefs = result['coefs'].rename_axis('term').reset_index()
+    anova = result['anova'].rename_axis('term').reset_index()
+    frames = [coefs.assign(table = 'coefs', **meta), anova.assign(table = 'anova', **meta)]
+    for marginal_vars, estimates, comparisons in result['post_hoc']:
+        term = ':'.join(marginal_vars)
+        levels = estimates[marginal_vars].astype(str).agg(', '.join, axis = 1)
+        frames.append(estimates.drop(columns = marginal_vars)
+                      .assign(table = 'estimates', term = term, level = levels, **meta))
+        frames.append(comparisons.rename(columns = {'Contrast': 'contrast'})
+                      .assign(table = 'contrasts', term = term, **meta))
+    return frames
+
+
+# jobs and their run_jobs() results -> one table, META columns first
+def collect(jobs, results):
+    frames = [frame for job, result in zip(jobs, results) for frame in result_rows(job, result)]
+    table = pd.concat(frames, ignore_index = True)
+    for column in META:
+        if column not in table:
+            table[column] = None
+    return table[META + [column for column in table.columns if column not in META]]
+
+
+# <out_dir>/tables.parquet plus a tables.csv mirror; without pyarrow (or fastparquet)
+# only the CSV is written
+def write_tables(table, out_dir):
+    os.makedirs(out_dir, exist_ok = True)
+    paths = []
+    try:
+        table.to_parquet(os.path.join(out_dir, TABLES + '.parquet'), index = False)
+        paths.append(os.path.join(out_dir, TABLES + '.parquet'))
+    except ImportError:
+        print("no Parquet engine (pyarrow) installed; writing the CSV only")
+    table.to_csv(os.path.join(out_dir, TABLES + '.csv'), index = False)
+    paths.append(os.path.join(out_dir, TABLES + '.csv'))
+    return paths
+
+
+def load_tables(out_dir):
+    path = os.path.join(out_dir, TABLES + '.parquet')
+    if os.path.exists(path):
+        return pd.read_parquet(path)
+    return pd.read_csv(os.path.join(out_dir, TABLES + '.csv'), keep_default_na = False,
+                       na_values = [''])
+
+
+def image_key(rows, dpi):
+    h = hashlib.sha256(f'{dpi}'.encode())
+    h.update(pd.util.hash_pandas_object(rows, index = False).values.tobytes())
+    return h.hexdigest()
+
+
+def format_cell(column, value):
+    if pd.isna(value):
+        return ''
+    if column == 'P-val':
+        return '<.001' if value < 0.001 else f'{value:.3f}'
+    if isinstance(value, float):
+        # anova/contrast df are whole numbers except Satterthwaite's
+        if column in ('NumDF', 'DenomDF', 'DF') and value.is_integer():
+            return f'{value:.0f}'
+        # significant figures: inverse_gaussian estimates on the 1/mu^2 scale are ~1e-6
+        return f'{value:.4g}'
+    return str(value)
+
+
+# one table's rows as text, without the columns that table does not use and with the
+# p-value and stars last
+def image_cells(rows, kind):
+    rows = rows.dropna(axis = 1, how = 'all')
+    last = [column for column in ('P-val', 'Sig') if column in rows]
+    columns = IMAGE_COLUMNS[kind] + [column for column in rows.columns if column not in META + last] + last
+    cells = [[format_cell(column, value) for column, value in zip(columns, row)]
+             for row in rows[columns].itertuples(index = False)]
+    return columns, cells
+
+
+# a PNG per model and table (<model>_<table>.png) drawn with matplotlib's own table
+# artist on one reused figure, in this process; the layout is fixed from the cells'
+# text lengths, so nothing is measured while drawing. An image is only drawn again when
+# its rows changed (keyed like render.py's figures) or force is set; returns the
+# images drawn
+def render_tables(table, out_dir, dpi = 200, force = False):
+    from render import load_manifest, save_manifest
+
+    os.makedirs(out_dir, exist_ok = True)
+    manifest = load_manifest(out_dir, MANIFEST)
+    todo = []
+    for (model, kind), rows in table.groupby(['model', 'table'], sort = False):
+        name = f'{model}_{kind}.png'
+        key = image_key(rows, dpi)
+        if force or manifest.get(name) != key or not os.path.exists(os.path.join(out_dir, name)):
+            todo.append((model, kind, rows, name, key))
+    if not todo:
+        return []
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig = plt.figure()
+    paths = []
+    # the manifest is saved even if an image fails, so finished images are not redrawn
+    try:
+        for model, kind, rows, name, key in todo:
+            columns, cells = image_cells(rows, kind)
+            chars = [max(len(text) for text in [column] + [row[i] for row in cells]) + 2
+                     for i, column in enumerate(columns)]
+            height = ROW_HEIGHT * (len(cells) + 1)
+            fig.clf()
+            fig.set_size_inches(CHAR_WIDTH * sum(chars), height + TITLE_HEIGHT)
+            ax = fig.add_axes([0, 0, 1, height / (height + TITLE_HEIGHT)])
+            ax.axis('off')
+            ax.set_title(f'{model}: {kind}', loc = 'left', fontsize = 9, pad = 4)
+            artist = ax.table(cellText = cells, colLabels = columns, colWidths = [n / sum(chars) for n in chars],
+                              bbox = [0, 0, 1, 1], cellLoc = 'right', edges = 'horizontal')
+            artist.auto_set_font_size(False)
+            artist.set_fontsize(8)
+            path = os.path.join(out_dir, name)
+            fig.savefig(path, dpi = dpi)
+            manifest[name] = key
+            paths.append(path)
+    finally:
+        plt.close(fig)
+        save_manifest(manifest, out_dir, MANIFEST)
+    return paths
+
+
+# the tables of the spec's fitted models (results/models/<name>.pkl)
+def spec_tables(spec):
+    from pipeline import _load_pickle, output_path, spec_job
+
+    jobs, results = [], []
+    for name, entry in spec['models'].items():
+        result = _load_pickle(output_path(spec, f'model:{name}'))
+        if result is not None:
+            jobs.append(spec_job(name, entry))
+            results.append(result)
+    if not results:
+        raise ValueError("No fitted models to export; run the pipeline first")
+    return collect(jobs, results)
+
+
+# writes the tables and draws the images whose rows changed (every image with force)
+def export(spec, out_dir = None, images = True, force = False):
+    out_dir = out_dir or spec.get('output_dir', 'results')
+    table = spec_tables(spec)
+    paths = write_tables(table, out_dir)
+    if images:
+        paths += render_tables(table, os.path.join(out_dir, TABLES), force = force)
+    print(f"{len(table)} rows from {table['model'].nunique()} models -> {len(paths)} files in {out_dir}")
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Export the anova and post-hoc tables of the fitted spec models.')
+    parser.add_argument('--spec', default = 'analysis_spec.json')
+    parser.add_argument('--out-dir', default = None, help = "default: the spec's output_dir")
+    parser.add_argument('--no-images', action = 'store_true', help = 'only write the Parquet/CSV tables')
+    parser.add_argument('--force', action = 'store_true', help = 'redraw every table image')
+    args = parser.parse_args()
+
+    from pipeline import load_spec
+
+    export(load_spec(args.spec), args.out_dir, not args.no_images, args.force)
+
+
+if __name__ == '__main__':
+    main()
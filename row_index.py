@@ -0,0 +1,86 @@
+import itertools
+
+import numpy as np
+
+# cleaned trials are stored sorted by these factors (first key slowest), so the trials of
+# any level are a few contiguous row ranges and a subset is a slice, not a scan of the
+# frame; the spec subsets on Awareness and Task, so those come first and their levels
+# are one and two ranges
+SORT_KEYS = ['Awareness', 'Task', 'Attention', 'Region']
+
+
+def sort_keys(df):
+    return [key for key in SORT_KEYS if key in df and hasattr(df[key], 'cat')]
+
+
+# one integer per row whose order is the lexicographic order of the keys' level codes
+def cell_codes(df, keys):
+    code = np.zeros(len(df), dtype = np.int64)
+    for key in keys:
+        codes = df[key].cat.codes.to_numpy()
+        if (codes < 0).any():
+            return None
+        code = code * len(df[key].cat.categories) + codes
+    return code
+
+
+# the frame sorted by the design factors; stable, so rows of a cell keep their order
+# (appending trials and sorting again gives the same frame as sorting all of them)
+def sort_design(df):
+    code = cell_codes(df, sort_keys(df))
+    if code is None or (np.diff(code) >= 0).all():
+        return df
+    return df.iloc[np.argsort(code, kind = 'stable')].reset_index(drop = True)
+
+
+# adjacent ranges merged, so a level spanning neighbouring cells is one range
+def merge_ranges(starts, stops):
+    ranges = []
+    for start, stop in zip(starts.tolist(), stops.tolist()):
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], stop)
+        else:
+            ranges.append((start, stop))
+    return ranges
+
+
+# {'keys', 'ranges'} for a frame sorted by sort_design(): 'ranges' maps every level and
+# level combination of the keys, as ((column, level), ...) in key order, to its
+# [(start, stop), ...] row ranges; None if the frame is not sorted
+def build(df):
+    keys = sort_keys(df)
+    code = cell_codes(df, keys)
+    if not keys or code is None or (np.diff(code) < 0).any():
+        return None
+
+    change = np.flatnonzero(np.diff(code)) + 1
+    starts = np.r_[0, change] if len(df) else np.array([], dtype = np.int64)
+    stops = np.r_[change, len(df)] if len(df) else np.array([], dtype = np.int64)
+    cells = np.column_stack([df[key].cat.codes.to_numpy()[starts] for key in keys])
+    levels = {key: list(df[key].cat.categories) for key in keys}
+
+    ranges = {}
+    for n in range(len(keys) + 1):
+        for columns in itertools.combinations(range(len(keys)), n):
+            for codes in itertools.product(*(range(len(levels[keys[i]])) for i in columns)):
+                member = np.ones(len(cells), dtype = bool)
+                for i, c in zip(columns, codes):
+                    member &= cells[:, i] == c
+                label = tuple((keys[i], levels[keys[i]][c]) for i, c in zip(columns, codes))
+                ranges[label] = merge_ranges(starts[member], stops[member])
+    return {'keys': keys, 'ranges': ranges}
+
+
+# the rows of a {column: level} subset: a slice of df (no copy) when they are one range,
+# the ranges taken together otherwise; None if the index does not cover the subset
+def lookup(df, index, subset):
+    if index is None or any(column not in index['keys'] for column in subset):
+        return None
+    label = tuple((key, subset[key]) for key in index['keys'] if key in subset)
+    if label not in index['ranges']:
+        # a level the factor does not have
+        return df.iloc[:0]
+    ranges = index['ranges'][label]
+    if len(ranges) == 1:
+        return df.iloc[ranges[0][0]:ranges[0][1]]
+    return df.iloc[np.concatenate([np.arange(start, stop) for start, stop in ranges] or [[]]).astype(np.int64)]
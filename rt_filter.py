@@ -0,0 +1,66 @@
+import argparse
+
+from preprocessing import clean_raw_rt, load_clean
+
+# design cells used for per-condition cutoffs
+CONDITION = ['Subject', 'Awareness', 'Attention', 'Region', 'Task']
+groupings = {'subject': ['Subject'], 'condition': CONDITION}
+
+
+# drops anticipations (RT <= min_rt) and then trials more than sd_cutoff SDs from
+# the mean of their group; returns the kept trials and the trials dropped per step
+def filter_rt(df, min_rt = 150, sd_cutoff = 2.5, by = 'subject'):
+    keys = groupings.get(by, by)
+    report = {'input': len(df)}
+
+    df = df[df['Target.RT'] > min_rt]
+    report['min_rt'] = report['input'] - len(df)
+
+    # cutoffs in float64 even though RTs are stored as float32
+    rt = df['Target.RT'].astype('float64')
+    grouped = rt.groupby([df[k] for k in keys], observed = True)
+    mean = grouped.transform('mean')
+    sd = grouped.transform('std')
+    # single-trial groups have no SD; keep them rather than dropping them silently
+    keep = ((rt - mean).abs() <= sd_cutoff * sd) | sd.isna()
+    report['sd'] = int((~keep).sum())
+
+    df = df[keep].reset_index(drop = True)
+    report['output'] = len(df)
+    return df, report
+
+
+def print_report(report, min_rt, sd_cutoff, by):
+    print(f"{report['input']} trials in")
+    print(f"{report['min_rt']} dropped: RT <= {min_rt} ms")
+    print(f"{report['sd']} dropped: beyond +/- {sd_cutoff} SD ({by})")
+    print(f"{report['output']} trials kept")
+
+
+# the rows filter-rt keeps from an export read with read_export(): its Present trials,
+# cleaned, then filtered; by subject, a subject's rows do not depend on the others'
+def filter_export(raw_data, min_rt = 150, sd_cutoff = 2.5, by = 'subject'):
+    return filter_rt(clean_raw_rt(raw_data), min_rt, sd_cutoff, by)
+
+
+# filtered rt data straight from raw_data_all.csv
+def load_filtered_rt(path = 'raw_data_all.csv', min_rt = 150, sd_cutoff = 2.5, by = 'subject'):
+    return filter_rt(load_clean(path, 'raw_rt'), min_rt, sd_cutoff, by)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Write rt_filtered.csv from raw_data_all.csv.')
+    parser.add_argument('--input', default = 'raw_data_all.csv')
+    parser.add_argument('--output', default = 'rt_filtered.csv')
+    parser.add_argument('--min-rt', type = float, default = 150)
+    parser.add_argument('--sd', type = float, default = 2.5)
+    parser.add_argument('--by', choices = sorted(groupings), default = 'subject')
+    args = parser.parse_args()
+
+    df, report = load_filtered_rt(args.input, args.min_rt, args.sd, args.by)
+    print_report(report, args.min_rt, args.sd, args.by)
+    df.to_csv(args.output, sep = ';', index = False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+
+from aggregate import rollup, subset_cube
+from posthoc import p_adjust
+
+# used for every figure with 'pairs' and no hand-written 'annotations';
+# a figure's "test" entry overrides any of these
+TEST_DEFAULTS = {'method': 'signflip', 'n_perm': 10000, 'p_adjust': 'holm', 'seed': 0}
+
+# statannotations' text_format='star' thresholds
+STARS = [(1e-4, '****'), (1e-3, '***'), (1e-2, '**'), (5e-2, '*')]
+
+
+def stars(p):
+    for cutoff, label in STARS:
+        if p <= cutoff:
+            return label
+    return 'ns'
+
+
+# +/-1 sign patterns (n_perm x n_subjects); every pattern when there are no more
+# than n_perm of them, which makes the test exact
+def sign_flips(n_subjects, n_perm, rng):
+    if 2 ** n_subjects <= n_perm:
+        patterns = np.arange(2 ** n_subjects)[:, None] >> np.arange(n_subjects) & 1
+        return 2 * patterns - 1, True
+    return rng.choice([-1, 1], size = (n_perm, n_subjects)), False
+
+
+# paired sign-flip tests of the mean difference, one per row of diffs
+# (n_tests x n_subjects, NaN where a subject lacks a cell); all tests share the
+# same flips and the whole null distribution is one matrix product
+def sign_flip_test(diffs, n_perm = 10000, seed = 0):
+    diffs = np.atleast_2d(np.asarray(diffs, dtype = float))
+    n = np.sum(~np.isnan(diffs), axis = 1)
+    d = np.nan_to_num(diffs)
+    observed = d.sum(axis = 1) / n
+
+    flips, exact = sign_flips(d.shape[1], n_perm, np.random.default_rng(seed))
+    null = (flips @ d.T) / n
+    # flipping signs keeps the sum of squares, so |mean| orders the flips exactly as |t| would
+    extreme = np.sum(np.abs(null) >= np.abs(observed) * (1 - 1e-12), axis = 0)
+    p = extreme / len(flips) if exact else (extreme + 1) / (len(flips) + 1)
+
+    sd = np.sqrt((np.sum(d ** 2, axis = 1) - n * observed ** 2) / (n - 1))
+    return pd.DataFrame({'n': n, 'mean_diff': observed, 't': observed / (sd / np.sqrt(n)), 'p': p})
+
+
+# unpaired permutation test of the difference in means, for levels measured on
+# different subjects; each row of the permutation matrix relabels the pooled values
+def permutation_test(a, b, n_perm = 10000, seed = 0):
+    a, b = np.asarray(a, dtype = float), np.asarray(b, dtype = float)
+    pooled = np.concatenate([a, b])
+    observed = a.mean() - b.mean()
+
+    order = np.argsort(np.random.default_rng(seed).random((n_perm, len(pooled))), axis = 1)
+    shuffled = pooled[order]
+    null = shuffled[:, :len(a)].mean(axis = 1) - shuffled[:, len(a):].mean(axis = 1)
+    p = (np.sum(np.abs(null) >= np.abs(observed) * (1 - 1e-12)) + 1) / (n_perm + 1)
+    return {'n': len(pooled), 'mean_diff': observed, 't': np.nan, 'p': p}
+
+
+# every pair of a figure within every panel, tested on subject-level means rolled
+# up from the cell-means cube and corrected together as one family
+def figure_tests(fig, cube):
+    options = dict(TEST_DEFAULTS, **fig.get('test', {}))
+    x, panels, measure = fig['x'], fig.get('panels'), fig['measure']
+    keys = ['Subject', x] + ([panels] if panels else [])
+    means = rollup(subset_cube(cube, fig.get('subset', {})), keys, measure)
+
+    rows, diffs = [], []
+    for panel, group in (means.groupby(panels, observed = True) if panels else [(None, means)]):
+        wide = group.pivot_table(index = 'Subject', columns = x, values = measure, observed = True)
+        for a, b in fig['pairs']:
+            rows.append({'panel': panel, 'a': a, 'b': b})
+            if options['method'] == 'signflip':
+                diffs.append((wide[a] - wide[b]).reindex(means['Subject'].unique()).to_numpy())
+            else:
+                rows[-1].update(permutation_test(wide[a].dropna(), wide[b].dropna(),
+                                                 options['n_perm'], options['seed']))
+
+    results = pd.DataFrame(rows)
+    if options['method'] == 'signflip':
+        tested = sign_flip_test(np.vstack(diffs), options['n_perm'], options['seed'])
+        results = pd.concat([results, tested], axis = 1)
+    elif options['method'] != 'permutation':
+        raise ValueError(f"Unknown test method '{options['method']}'; use 'signflip' or 'permutation'")
+
+    results['p_adj'] = p_adjust(results['p'].to_numpy(), options['p_adjust'])
+    results['annotation'] = [stars(p) for p in results['p_adj']]
+    return results
+
+
+# annotations in the form draw_figure() takes: one label per pair, per panel level
+def annotations(results):
+    if results['panel'].isna().all():
+        return list(results['annotation'])
+    return {str(panel): list(group['annotation']) for panel, group in results.groupby('panel', sort = False)}
@@ -0,0 +1,81 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from rt_filter import filter_export
+
+# raw codes as they appear in the E-Prime exports
+ATTENTION = ['Attended', 'Unattended']
+REGION = ['F', 'V']
+TASK = ['Alerting', 'Orienting']
+EXPORT_COLUMNS = ['Subject', 'Seen', 'Attention', 'Region', 'Task', 'Target.RT', 'Target.ACC',
+                  'TargetPresence', 'Awareness']
+
+
+# trial-level data with the schema of raw_data_all.csv; n_trials is per subject,
+# spread evenly over the Attention x Region x Task cells. Effects are small fixed
+# shifts plus per-subject intercepts, so every model in the spec has something to fit
+def generate(n_subjects = 20, n_trials = 320, seed = 0, absent_rate = 0.1, missing_rate = 0.005):
+    rng = np.random.default_rng(seed)
+    n = n_subjects * n_trials
+
+    cells = np.arange(n) % 8
+    df = pd.DataFrame({'Subject': np.repeat(np.arange(1, n_subjects + 1), n_trials),
+                       'Attention': np.take(ATTENTION, cells % 2),
+                       'Region': np.take(REGION, cells // 2 % 2),
+                       'Task': np.take(TASK, cells // 4)})
+    subject = df['Subject'].to_numpy() - 1
+    attended = (df['Attention'] == 'Attended').to_numpy()
+    fef = (df['Region'] == 'F').to_numpy()
+
+    # awareness: logistic, attended targets and vertex stimulation seen more often
+    logit = rng.normal(0, 0.8, n_subjects)[subject] + 0.4 * attended - 0.2 * fef
+    seen = rng.random(n) < 1 / (1 + np.exp(-logit))
+
+    # accuracy: higher on seen and attended trials
+    logit = 1 + rng.normal(0, 0.5, n_subjects)[subject] + 1.2 * seen + 0.3 * attended
+    acc = rng.random(n) < 1 / (1 + np.exp(-logit))
+
+    # RT: inverse Gaussian (Wald) around a subject mean, slower on unattended and FEF trials
+    mu = rng.normal(480, 60, n_subjects)[subject] + 25 * ~attended + 15 * fef - 20 * seen
+    rt = rng.wald(np.maximum(mu, 250) - 100, 4000) + 100
+
+    codes = np.where(seen, '1', '0')
+    df['Seen'] = codes
+    df['Target.RT'] = rt.round(0)
+    df['Target.ACC'] = acc.astype(int)
+    df['TargetPresence'] = np.where(rng.random(n) < absent_rate, 'Absent', 'Present')
+    df['Awareness'] = codes
+    # a few missing responses, as in the real exports
+    df.loc[rng.random(n) < missing_rate, 'Target.RT'] = np.nan
+    return df[EXPORT_COLUMNS]
+
+
+# writes raw_data_all.csv and rt_filtered.csv (RT > 150 ms, +/- 2.5 SD by subject)
+def write_exports(out_dir, n_subjects = 20, n_trials = 320, seed = 0):
+    os.makedirs(out_dir, exist_ok = True)
+    raw = generate(n_subjects, n_trials, seed)
+    raw.to_csv(os.path.join(out_dir, 'raw_data_all.csv'), sep = ';', index = False)
+    # as 'cli.py filter-rt' writes it: the cleaned, filtered Present trials
+    rt, _ = filter_export(raw)
+    rt.to_csv(os.path.join(out_dir, 'rt_filtered.csv'), sep = ';', index = False)
+    return len(raw), len(rt)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Write synthetic raw_data_all.csv and rt_filtered.csv.')
+    parser.add_argument('--out-dir', default = 'synthetic')
+    parser.add_argument('--subjects', type = int, default = 20)
+    parser.add_argument('--trials', type = int, default = 320, help = 'trials per subject')
+    parser.add_argument('--seed', type = int, default = 0)
+    args = parser.parse_args()
+
+    n_raw, n_rt = write_exports(args.out_dir, args.subjects, args.trials, args.seed)
+    print(f"{n_raw} trials -> {os.path.join(args.out_dir, 'raw_data_all.csv')}")
+    print(f"{n_rt} trials -> {os.path.join(args.out_dir, 'rt_filtered.csv')}")
+
+
+if __name__ == '__main__':
+    main()
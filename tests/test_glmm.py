@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from glmm import GLMM
+
+
+def balanced(seed = 1, n = 30):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'Subject': np.repeat(np.arange(n), 20),
+                       'Task': np.tile(['Alerting', 'Orienting'], n * 10)})
+    df['y'] = (np.where(df['Task'] == 'Alerting', 5, 6) + rng.normal(0, .3, n)[df['Subject']]
+               + rng.normal(0, 1, len(df)))
+    return df
+
+
+# the post-hoc contrasts must be built with the coding the model was fitted with, so in
+# a balanced design either coding gives the observed group means
+@pytest.mark.parametrize('ordered', [False, True])
+def test_post_hoc_uses_the_fitted_coding(ordered):
+    df = balanced()
+    model = GLMM('y ~ Task + (1|Subject)', data = df, family = 'gaussian')
+    model.fit(factors = {'Task': ['Alerting', 'Orienting']}, ordered = ordered, summarize = False)
+    estimates, comparisons = model.post_hoc('Task', summarize = False)
+    means = df.groupby('Task')['y'].mean()
+    np.testing.assert_allclose(estimates['Estimate'], means.to_numpy(), atol = 1e-3)
+    np.testing.assert_allclose(comparisons['Estimate'].iloc[0], means.iloc[0] - means.iloc[1], atol = 1e-3)
@@ -0,0 +1,72 @@
+import io
+import os
+
+import pandas as pd
+import pytest
+
+from aggregate import cube_path, load_cube
+from ingest import add_export, source_cubes
+from preprocessing import cache_path, read_cache, read_export, sessions_dir, stream_clean
+from rt_filter import filter_export
+from synthetic import generate
+
+SPEC = {'data': {'rt': {'path': 'rt_filtered.csv', 'kind': 'rt'},
+                 'raw': {'path': 'raw_data_all.csv', 'kind': 'raw'},
+                 'raw_rt': {'path': 'raw_data_all.csv', 'kind': 'raw_rt', 'filter': {'by': 'condition'}},
+                 'raw_rt_subject': {'path': 'raw_data_all.csv', 'kind': 'raw_rt', 'filter': {}}},
+        'figures': {'rt': {'data': 'rt', 'measure': 'Target.RT'},
+                    'acc': {'data': 'raw', 'measure': 'Target.ACC'},
+                    'rt_condition': {'data': 'raw_rt', 'measure': 'Target.RT'},
+                    'rt_subject': {'data': 'raw_rt_subject', 'measure': 'Target.RT'}}}
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+# five subjects' exports, rt_filtered.csv in the export's own format, and a sixth
+# subject's session export
+@pytest.fixture
+def exports(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    raw = generate(n_subjects = 6, n_trials = 64, seed = 3)
+    old = raw[raw['Subject'] <= 5]
+    old.to_csv('raw_data_all.csv', sep = ';', index = False)
+    old[old['Target.RT'] > 150].to_csv('rt_filtered.csv', sep = ';', index = False)
+    raw[raw['Subject'] == 6].to_csv('s6.csv', sep = ';', index = False)
+    return {path: read_bytes(path) for path in ('raw_data_all.csv', 'rt_filtered.csv', 's6.csv')}
+
+
+def test_exports_are_not_rewritten(exports):
+    added = add_export(SPEC, 's6.csv')
+    for path in ('raw_data_all.csv', 'rt_filtered.csv'):
+        assert read_bytes(path) == exports[path]
+        assert added[path][0] == os.path.join(sessions_dir(path), 's6.csv')
+
+    # the raw export is copied, the rt file gets what filter-rt writes for the export
+    assert read_bytes(added['raw_data_all.csv'][0]) == exports['s6.csv']
+    rows, _ = filter_export(read_export('s6.csv'))
+    expected = read_export(io.StringIO(rows.to_csv(sep = ';', index = False)))
+    pd.testing.assert_frame_equal(read_export(added['rt_filtered.csv'][0]), expected)
+
+
+def test_caches_match_a_cold_rebuild(exports):
+    add_export(SPEC, 's6.csv')
+    for name, source in SPEC['data'].items():
+        cold, _ = stream_clean(source['path'], source['kind'])
+        assert set(cold['Subject'].cat.categories) == {1, 2, 3, 4, 5, 6}
+        pd.testing.assert_frame_equal(read_cache(cache_path(source['path'], source['kind'])), cold)
+        for measure, options in source_cubes(SPEC, name).items():
+            cube = read_cache(cube_path(source['path'], source['kind'], measure, options))
+            pd.testing.assert_frame_equal(cube, load_cube(source['path'], source['kind'], measure, options,
+                                                          cache = False))
+
+
+def test_a_session_is_added_once(exports):
+    add_export(SPEC, 's6.csv')
+    with pytest.raises(ValueError, match = 'already been added'):
+        add_export(SPEC, 's6.csv')
+    os.rename('s6.csv', 's6_again.csv')
+    with pytest.raises(ValueError, match = 'already in'):
+        add_export(SPEC, 's6_again.csv')
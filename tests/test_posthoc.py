@@ -0,0 +1,68 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import stats
+
+from design import coef_matrix, coef_names
+from posthoc import batch_post_hoc
+
+FACTORS = {'Attention': ['Attended', 'Unattended'], 'Region': ['FEF', 'Vertex']}
+NAMES = ['(Intercept)', 'Attention1', 'Region1', 'Attention1:Region1']
+
+
+# treatment coding: Attended/FEF is the intercept, every other cell adds its terms
+def test_treatment_contrast_by_hand():
+    beta = np.array([1.0, 0.4, -0.2, 0.3])
+    vcov = np.diag([0.04, 0.01, 0.02, 0.09])
+    [(_, estimates, contrasts)] = batch_post_hoc(NAMES, beta, vcov, FACTORS, [['Attention']], 'bonf',
+                                                 ordered = False)
+
+    # marginal means average over Region's two levels
+    assert estimates['Attention'].tolist() == ['Attended', 'Unattended']
+    np.testing.assert_allclose(estimates['Estimate'], [1.0 - 0.1, 1.0 + 0.4 - 0.1 + 0.15])
+
+    L = np.array([0, -1, 0, -0.5])
+    se = np.sqrt(L @ vcov @ L)
+    assert contrasts['Contrast'].tolist() == ['Attended - Unattended']
+    np.testing.assert_allclose(contrasts['Estimate'], [-(0.4 + 0.15)])
+    np.testing.assert_allclose(contrasts['SE'], [se])
+    np.testing.assert_allclose(contrasts['P-val'], [2 * stats.norm.sf(0.55 / se)])
+
+
+def test_estimates_are_not_rounded():
+    beta = np.array([4.4e-6, 2e-7, -1e-7, 3e-8])
+    vcov = np.eye(4) * 1e-14
+    [(_, estimates, contrasts)] = batch_post_hoc(NAMES, beta, vcov, FACTORS, [['Region']], ordered = False)
+    assert (estimates['Estimate'] != 0).all()
+    assert (contrasts['SE'] != 0).all()
+
+
+# on the cell means of a saturated model, the marginal means are the observed means
+# whatever the contrast coding
+@pytest.mark.parametrize('ordered', [False, True])
+def test_marginal_means_match_cell_means(ordered):
+    cells = pd.DataFrame(list(itertools.product(*FACTORS.values())), columns = list(FACTORS))
+    means = np.array([5.0, 6.5, 5.5, 8.0])
+    names = coef_names([('Attention',), ('Region',), ('Attention', 'Region')], FACTORS)
+    beta = np.linalg.solve(coef_matrix(cells, names, FACTORS, ordered), means)
+    results = batch_post_hoc(names, beta, np.eye(4), FACTORS, [['Attention'], ['Attention', 'Region']],
+                             ordered = ordered)
+
+    np.testing.assert_allclose(results[0][1]['Estimate'], [5.75, 6.75])
+    # the first variable varies fastest, as in emmeans
+    both = results[1][1]
+    observed = cells.assign(mean = means).set_index(['Attention', 'Region'])['mean']
+    np.testing.assert_allclose(both['Estimate'], observed.loc[list(zip(both['Attention'], both['Region']))])
+
+
+def test_bonferroni_over_every_pair():
+    beta = np.array([1.0, 0.3, 0.2, 0.1])
+    vcov = np.eye(4) * 0.05
+    [(_, _, raw)] = batch_post_hoc(NAMES, beta, vcov, FACTORS, [['Attention', 'Region']], 'none',
+                                   ordered = False)
+    [(_, _, bonf)] = batch_post_hoc(NAMES, beta, vcov, FACTORS, [['Attention', 'Region']], 'bonf',
+                                    ordered = False)
+    assert len(raw) == 6
+    np.testing.assert_allclose(bonf['P-val'], np.minimum(raw['P-val'] * 6, 1))
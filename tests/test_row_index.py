@@ -0,0 +1,78 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import row_index
+from design import set_levels
+from model_runner import FACTORS, subset_frame
+
+
+# trials in file order: every cell, several subjects, unbalanced cell sizes
+def trials(n = 400, seed = 0):
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({factor: rng.choice(levels, n) for factor, levels in FACTORS.items()})
+    data['Subject'] = rng.integers(1, 6, n)
+    data['Target.RT'] = rng.normal(500, 50, n)
+    return set_levels(data, FACTORS)
+
+
+def mask_subset(df, subset):
+    for column, level in subset.items():
+        df = df[df[column] == level]
+    return df
+
+
+def every_subset():
+    for n in range(len(FACTORS) + 1):
+        for columns in itertools.combinations(FACTORS, n):
+            for levels in itertools.product(*(FACTORS[column] for column in columns)):
+                yield dict(zip(columns, levels))
+
+
+def test_subsets_match_boolean_masks():
+    df = row_index.sort_design(trials())
+    index = row_index.build(df)
+    assert index is not None
+    for subset in every_subset():
+        pd.testing.assert_frame_equal(subset_frame(df, subset, index), mask_subset(df, subset))
+
+
+def test_leading_factors_are_single_slices():
+    index = row_index.build(row_index.sort_design(trials()))
+    for level in FACTORS['Awareness']:
+        assert len(index['ranges'][(('Awareness', level),)]) == 1
+    for level in FACTORS['Task']:
+        assert len(index['ranges'][(('Task', level),)]) == 2
+
+
+# sorting is stable, so sorting appended trials again gives the same frame as sorting
+# all of them at once
+def test_sort_is_stable_across_appends():
+    df = trials()
+    old, new = df.iloc[:250], df.iloc[250:]
+    again = row_index.sort_design(pd.concat([row_index.sort_design(old), new], ignore_index = True))
+    pd.testing.assert_frame_equal(again, row_index.sort_design(df))
+
+
+def test_unsorted_frames_fall_back_to_masks():
+    df = trials()
+    assert row_index.build(df) is None
+    subset = {'Task': 'Orienting', 'Region': 'FEF'}
+    pd.testing.assert_frame_equal(subset_frame(df, subset, None), mask_subset(df, subset))
+
+
+@pytest.mark.parametrize('subset', [{'Subject': 3}, {'Task': 'Other'}])
+def test_subsets_outside_the_index(subset):
+    df = row_index.sort_design(trials())
+    rows = subset_frame(df, subset, row_index.build(df))
+    assert len(rows) == len(mask_subset(df, subset))
+
+
+def test_lookup_returns_none_or_empty():
+    df = row_index.sort_design(trials())
+    index = row_index.build(df)
+    assert row_index.lookup(df, index, {'Subject': 3}) is None
+    assert row_index.lookup(df, None, {'Task': 'Orienting'}) is None
+    assert len(row_index.lookup(df, index, {'Task': 'Other'})) == 0
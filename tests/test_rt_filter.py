@@ -0,0 +1,49 @@
+import pandas as pd
+
+from rt_filter import filter_rt
+
+
+def trials(*groups):
+    frames = [pd.DataFrame({'Subject': subject, 'Awareness': 'Seen', 'Attention': 'Attended', 'Region': 'FEF',
+                            'Task': task, 'Target.RT': rts})
+              for subject, task, rts in groups]
+    return pd.concat(frames, ignore_index = True)
+
+
+def kept(df, subject):
+    return sorted(df.loc[df['Subject'] == subject, 'Target.RT'])
+
+
+# subject 1: 100 is below the floor; of the rest (mean 540, SD sqrt(8000) = 89.4) 700
+# is 1.79 SDs out. Subject 2: 150 is not above the floor; 300 and 310 are 0.71 SDs out.
+# Subject 3: 120 is below the floor, leaving a single trial with no SD
+def test_floor_then_subject_sd_cutoff():
+    df = trials((1, 'Alerting', [100, 500, 500, 500, 500, 700]), (2, 'Alerting', [150, 300, 310]),
+                (3, 'Alerting', [120, 450]))
+    out, report = filter_rt(df, min_rt = 150, sd_cutoff = 1.5, by = 'subject')
+    assert kept(out, 1) == [500, 500, 500, 500]
+    assert kept(out, 2) == [300, 310]
+    assert kept(out, 3) == [450]
+    assert report == {'input': 11, 'min_rt': 3, 'sd': 1, 'output': 7}
+
+
+# Alerting mean 312, SD sqrt(720) = 26.8, so 360 is 1.79 SDs out within its condition,
+# but only 0.63 SDs from the subject's mean (456, SD 152.8); the Orienting trials have
+# SD 0 and are all kept
+def test_condition_cutoffs_differ_from_subject_cutoffs():
+    df = trials((4, 'Alerting', [300, 300, 300, 300, 360]), (4, 'Orienting', [600] * 5))
+    by_subject, report = filter_rt(df, min_rt = 150, sd_cutoff = 1.5, by = 'subject')
+    assert len(by_subject) == 10
+    assert report['sd'] == 0
+
+    by_condition, report = filter_rt(df, min_rt = 150, sd_cutoff = 1.5, by = 'condition')
+    assert kept(by_condition, 4) == [300, 300, 300, 300] + [600] * 5
+    assert report == {'input': 10, 'min_rt': 0, 'sd': 1, 'output': 9}
+
+
+def test_single_trial_groups_are_kept():
+    df = trials((1, 'Alerting', [400]), (1, 'Orienting', [900, 400, 410, 420]))
+    out, report = filter_rt(df, min_rt = 150, sd_cutoff = 1.0, by = 'condition')
+    assert 400 in kept(out[out['Task'] == 'Alerting'], 1)
+    assert report['sd'] == 1
+    assert kept(out, 1) == [400, 400, 410, 420]
@@ -0,0 +1,65 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from aggregate import build_cube
+from stats_tests import figure_tests, sign_flip_test
+
+
+# every one of the 2^n sign patterns, one at a time
+def brute_force_p(diffs):
+    observed = abs(np.mean(diffs))
+    patterns = list(itertools.product([-1, 1], repeat = len(diffs)))
+    extreme = sum(abs(np.mean(np.multiply(signs, diffs))) >= observed - 1e-12 for signs in patterns)
+    return extreme / len(patterns)
+
+
+def test_exact_branch_matches_enumeration():
+    rng = np.random.default_rng(0)
+    diffs = np.vstack([rng.normal(shift, 1, 10) for shift in (0, 0.5, 1, 2)])
+    result = sign_flip_test(diffs, n_perm = 10000)
+    np.testing.assert_allclose(result['p'], [brute_force_p(row) for row in diffs])
+    np.testing.assert_allclose(result['mean_diff'], diffs.mean(axis = 1))
+
+
+def test_monte_carlo_branch_never_gives_zero():
+    diffs = np.arange(1, 21, dtype = float)
+    result = sign_flip_test(diffs, n_perm = 999)
+    assert result['p'].iloc[0] == 1 / 1000
+
+
+# a subject without one of the cells drops out of that test only
+def test_nan_subjects_are_left_out():
+    rng = np.random.default_rng(1)
+    diffs = rng.normal(0.5, 1, (2, 9))
+    diffs[0, 3] = np.nan
+    result = sign_flip_test(diffs, n_perm = 10000)
+    alone = sign_flip_test(np.delete(diffs[0], 3), n_perm = 10000)
+    assert result['n'].tolist() == [8, 9]
+    np.testing.assert_allclose(result.iloc[0][['mean_diff', 't', 'p']].astype(float),
+                               alone.iloc[0][['mean_diff', 't', 'p']].astype(float))
+    assert result['p'].iloc[0] == brute_force_p(np.delete(diffs[0], 3))
+    assert result['p'].iloc[1] == brute_force_p(diffs[1])
+
+
+# 8 subjects: on FEF every subject is slower when unattended (exact p = 2/256), on the
+# vertex the differences are mixed; Holm corrects the two panels as one family
+def test_holm_across_panels():
+    fef = [40, 35, 50, 45, 30, 60, 55, 25]
+    vertex = [10, -20, 15, -5, 30, -25, 5, 12]
+    rows = []
+    for subject in range(8):
+        for region, diff in (('FEF', fef[subject]), ('Vertex', vertex[subject])):
+            rows.append((subject, region, 'Attended', 500.0))
+            rows.append((subject, region, 'Unattended', 500.0 + diff))
+    trials = pd.DataFrame(rows, columns = ['Subject', 'Region', 'Attention', 'Target.RT'])
+    trials = trials.assign(Task = 'Alerting', Awareness = 'Seen')
+    fig = {'x': 'Attention', 'panels': 'Region', 'measure': 'Target.RT', 'pairs': [['Attended', 'Unattended']]}
+
+    results = figure_tests(fig, build_cube(trials, 'Target.RT'))
+    p = [brute_force_p(-np.array(fef)), brute_force_p(-np.array(vertex))]
+    assert p[0] == 2 / 256
+    np.testing.assert_allclose(results['p'], p)
+    np.testing.assert_allclose(results['p_adj'], [2 * p[0], max(2 * p[0], p[1])])
+    assert results['annotation'].tolist() == ['*', 'ns']